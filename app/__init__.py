@@ -1,5 +1,7 @@
 import os
+import tempfile
 from flask import Flask
+from jinja2 import FileSystemBytecodeCache
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from dotenv import load_dotenv
@@ -22,6 +24,8 @@ def create_app(enable_scheduler: bool = True):
         f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
     )
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Number of sources synced in parallel by the scheduled sync check
+    app.config['SYNC_MAX_WORKERS'] = int(os.getenv('SYNC_MAX_WORKERS', '8'))
 
     # Initialize extensions with app
     db.init_app(app)
@@ -33,6 +37,13 @@ def create_app(enable_scheduler: bool = True):
     from app import routes
     app.register_blueprint(routes.bp)
 
+    # Share compiled templates between workers and compile them all up front
+    jinja_cache_dir = os.getenv('JINJA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'ailonka_jinja'))
+    os.makedirs(jinja_cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(jinja_cache_dir)
+    for template_name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template_name)
+
     # Initialize scheduler for background sync (only for main process)
     if enable_scheduler and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
         try:
@@ -1,12 +1,32 @@
 import os
+import threading
+from functools import lru_cache
 from flask_login import UserMixin
+from sqlalchemy.orm import joinedload
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
 from cryptography.fernet import Fernet
 from app import db, login_manager
 
-# Initialize Argon2 password hasher
-ph = PasswordHasher()
+# Initialize Argon2 password hasher with explicit parameters (OWASP 46 MiB profile).
+# Run tune_argon2.py on the deployment host to pick values for a target login latency.
+ph = PasswordHasher(
+    time_cost=3,
+    memory_cost=47104,  # KiB
+    parallelism=1,
+    hash_len=32,
+    salt_len=16,
+)
+
+# Caps concurrent Argon2 operations (and their memory_cost allocations) to one per core.
+# The hashing itself runs in C with the GIL released, so request threads hash in parallel.
+_argon2_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+
+@lru_cache(maxsize=1024)
+def _hash_needs_rehash(password_hash: str) -> bool:
+    """Check Argon2 parameters of a hash, memoized per PHC string"""
+    return ph.check_needs_rehash(password_hash)
 
 
 def get_encryption_key():
@@ -17,6 +37,25 @@ def get_encryption_key():
     # Fallback for development (not recommended for production)
     return Fernet.generate_key()
 
+
+# Fernet instance, built on first use so the key can be set after import
+_fernet = None
+
+
+def get_fernet() -> Fernet:
+    """Get the shared Fernet instance for API key encryption"""
+    global _fernet
+    if _fernet is None:
+        _fernet = Fernet(get_encryption_key())
+    return _fernet
+
+
+def mask_api_key(api_key: str) -> str:
+    """Return masked version of an API key for display"""
+    if api_key and len(api_key) > 12:
+        return api_key[:8] + '*' * (len(api_key) - 12) + api_key[-4:]
+    return ''
+
 class User(UserMixin, db.Model):
     """User model for authentication"""
     __tablename__ = 'users'
@@ -30,15 +69,17 @@ class User(UserMixin, db.Model):
 
     def set_password(self, password):
         """Hash password using Argon2"""
-        self.password_hash = ph.hash(password)
+        with _argon2_slots:
+            self.password_hash = ph.hash(password)
 
     def check_password(self, password):
         """Verify password using Argon2"""
         try:
-            ph.verify(self.password_hash, password)
+            with _argon2_slots:
+                ph.verify(self.password_hash, password)
             # Check if rehashing is needed (Argon2 will update parameters over time)
-            if ph.check_needs_rehash(self.password_hash):
-                self.password_hash = ph.hash(password)
+            if _hash_needs_rehash(self.password_hash):
+                self.set_password(password)
                 db.session.commit()
             return True
         except VerifyMismatchError:
@@ -55,29 +96,37 @@ class UserSettings(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), unique=True, nullable=False)
     encrypted_api_key = db.Column(db.Text, nullable=True)
+    masked_api_key = db.Column(db.String(255), nullable=True)  # Display-only, set alongside the ciphertext
     selected_model = db.Column(db.String(100), default='claude-3-5-haiku-latest')
 
     def set_api_key(self, api_key: str):
         """Encrypt and store API key"""
+        self._decrypted_key = None
         if api_key:
-            f = Fernet(get_encryption_key())
-            self.encrypted_api_key = f.encrypt(api_key.encode()).decode()
+            self.encrypted_api_key = get_fernet().encrypt(api_key.encode()).decode()
+            self.masked_api_key = mask_api_key(api_key)
         else:
             self.encrypted_api_key = None
+            self.masked_api_key = None
 
     def get_api_key(self) -> str | None:
-        """Decrypt and return API key"""
-        if self.encrypted_api_key:
-            f = Fernet(get_encryption_key())
-            return f.decrypt(self.encrypted_api_key.encode()).decode()
-        return None
+        """Decrypt and return API key (memoized on the instance)"""
+        if not self.encrypted_api_key:
+            return None
+        cached = getattr(self, '_decrypted_key', None)
+        if cached and cached[0] == self.encrypted_api_key:
+            return cached[1]
+        api_key = get_fernet().decrypt(self.encrypted_api_key.encode()).decode()
+        self._decrypted_key = (self.encrypted_api_key, api_key)
+        return api_key
+
+    def has_api_key(self) -> bool:
+        """Check whether an API key is stored, without decrypting it"""
+        return bool(self.encrypted_api_key)
 
     def get_masked_key(self) -> str:
         """Return masked version of API key for display"""
-        key = self.get_api_key()
-        if key and len(key) > 12:
-            return key[:8] + '*' * (len(key) - 12) + key[-4:]
-        return ''
+        return self.masked_api_key or ''
 
     def __repr__(self):
         return f'<UserSettings user_id={self.user_id}>'
@@ -85,8 +134,8 @@ class UserSettings(db.Model):
 
 @login_manager.user_loader
 def load_user(user_id):
-    """Load user by ID for Flask-Login"""
-    return User.query.get(int(user_id))
+    """Load user by ID for Flask-Login, with settings eager-loaded (Flask-Login memoizes current_user per request)"""
+    return db.session.get(User, int(user_id), options=[joinedload(User.settings)])
 
 
 class Source(db.Model):
@@ -107,6 +156,7 @@ class Source(db.Model):
     selectors = db.Column(db.JSON, nullable=True)  # Stored CSS/XPath selectors from LLM
     selector_version = db.Column(db.Integer, default=0)  # Tracks selector regeneration
     created_at = db.Column(db.DateTime, default=db.func.now())
+    updated_at = db.Column(db.DateTime, default=db.func.now(), onupdate=db.func.now())
 
     # Relationships
     user = db.relationship('User', backref=db.backref('sources', lazy='dynamic'))
@@ -120,6 +170,21 @@ class Source(db.Model):
 class Product(db.Model):
     """Product tracked from a source"""
     __tablename__ = 'products'
+    __table_args__ = (
+        # Dashboard "recent products" / "recent deals" lists (ORDER BY ... LIMIT 5)
+        db.Index('ix_products_source_first_seen', 'source_id', db.desc('first_seen_at')),
+        db.Index('ix_products_source_last_updated', 'source_id', db.desc('last_updated_at')),
+        db.Index('ix_products_source_price', 'source_id', 'current_price'),
+        db.Index('ix_products_favorite', 'source_id', postgresql_where=db.text('is_favorite')),
+        # Trigram index so the products search's ILIKE '%term%' doesn't scan every row (needs pg_trgm)
+        db.Index('ix_products_name_trgm', 'name', postgresql_using='gin',
+                 postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_products_price_drop', 'source_id', db.desc('last_updated_at'),
+                 postgresql_where=db.text('is_price_drop')),
+        # Sync matches extracted products to existing rows by URL within a source
+        db.UniqueConstraint('source_id', 'product_url', name='uq_product_source_url'),
+        db.Index('ix_products_source_available', 'source_id', 'is_available'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     source_id = db.Column(db.Integer, db.ForeignKey('sources.id'), nullable=False)
@@ -130,6 +195,9 @@ class Product(db.Model):
     image_url = db.Column(db.Text, nullable=True)
     current_price = db.Column(db.Numeric(10, 2), nullable=True)
     original_price = db.Column(db.Numeric(10, 2), nullable=True)
+    is_price_drop = db.Column(db.Boolean, db.Computed(
+        'original_price IS NOT NULL AND current_price < original_price', persisted=True
+    ))
     currency = db.Column(db.String(10), default='USD')
     is_available = db.Column(db.Boolean, default=True)
     is_favorite = db.Column(db.Boolean, default=False)
@@ -144,6 +212,17 @@ class Product(db.Model):
         return f'<Product {self.name[:50]}>'
 
 
+# Defined after Product so the correlated subquery can reference it.
+# Deferred: list routes opt in with undefer(Source.product_count) to avoid one COUNT per source.
+Source.product_count = db.column_property(
+    db.select(db.func.count(Product.id))
+    .where(Product.source_id == Source.id)
+    .correlate_except(Product)
+    .scalar_subquery(),
+    deferred=True
+)
+
+
 class PriceHistory(db.Model):
     """Historical price records for products"""
     __tablename__ = 'price_history'
@@ -160,6 +239,10 @@ class PriceHistory(db.Model):
 class SyncLog(db.Model):
     """Sync operation logs for tracking and debugging"""
     __tablename__ = 'sync_logs'
+    __table_args__ = (
+        # Latest-logs-per-source lookups (source detail page, sync stats)
+        db.Index('ix_sync_logs_source_started', 'source_id', db.desc('started_at')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     source_id = db.Column(db.Integer, db.ForeignKey('sources.id'), nullable=False)
@@ -175,3 +258,39 @@ class SyncLog(db.Model):
 
     def __repr__(self):
         return f'<SyncLog source_id={self.source_id} status={self.status}>'
+
+
+class ChatMessage(db.Model):
+    """Single chat turn, stored server-side instead of in the session cookie"""
+    __tablename__ = 'chat_messages'
+    __table_args__ = (
+        db.Index('ix_chat_messages_user_created', 'user_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    role = db.Column(db.String(20), nullable=False)  # user, assistant
+    content = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=db.func.now())
+
+    # Relationships
+    user = db.relationship('User', backref=db.backref('chat_messages', lazy='dynamic'))
+
+    def to_message(self) -> dict:
+        """Return the message in Anthropic API format"""
+        return {'role': self.role, 'content': self.content}
+
+    def __repr__(self):
+        return f'<ChatMessage user_id={self.user_id} role={self.role}>'
+
+
+class LlmCacheEntry(db.Model):
+    """Cached LLM response, keyed by a hash of the request"""
+    __tablename__ = 'llm_cache'
+
+    key = db.Column(db.String(128), primary_key=True)
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<LlmCacheEntry {self.key[:16]}>'
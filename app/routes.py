@@ -1,16 +1,120 @@
+import hashlib
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from datetime import datetime, timedelta
 from decimal import Decimal
 
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, session
+from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, Response, stream_with_context, g, current_app, abort, session, make_response
 from flask_login import login_user, logout_user, login_required, current_user
-from app.models import User, UserSettings, Source, Product, PriceHistory, SyncLog
-from app.services.anthropic_service import AnthropicService, AVAILABLE_MODELS
+import orjson
+from sqlalchemy import func
+from sqlalchemy.orm import contains_eager, undefer
+from app.models import User, UserSettings, Source, Product, PriceHistory, SyncLog, ChatMessage
+from app.services.anthropic_service import get_anthropic_service, AVAILABLE_MODELS, MODEL_LABELS
 from app.services.scraper_service import ScraperService
-from app.services.scheduler_service import sync_source
+from app.services.html_fetcher_service import HtmlFetcherService
+from app.services.scheduler_service import sync_source, queue_source_sync
 from app import db
 
 bp = Blueprint('main', __name__)
 
+# Number of most recent chat messages kept and sent to the model as context
+CHAT_HISTORY_LIMIT = 40
+
+# Products shown per page on the products list
+PRODUCTS_PER_PAGE = 50
+
+# Seconds the analyze preview waits on the static fetch before also starting the headless browser
+BROWSER_FETCH_GRACE = 5
+
+# Marker comment clean_html_for_llm adds when it falls back to product samples
+SAMPLES_COMMENT_RE = re.compile(r'Found (\d+) products, showing (\d+)')
+
+
+def sse_event(payload: dict) -> str:
+    """Format a payload as a Server-Sent Events data frame"""
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+
+def load_chat_history(user_id: int, limit: int = CHAT_HISTORY_LIMIT) -> list[dict]:
+    """Load the last `limit` chat messages for a user, oldest first"""
+    rows = ChatMessage.query.filter_by(user_id=user_id).order_by(
+        ChatMessage.created_at.desc(), ChatMessage.id.desc()
+    ).limit(limit).all()
+    messages = [row.to_message() for row in reversed(rows)]
+
+    # The API requires the conversation to start with a user turn
+    while messages and messages[0]['role'] != 'user':
+        messages.pop(0)
+    return messages
+
+
+def trim_chat_history(user_id: int, keep: int = CHAT_HISTORY_LIMIT):
+    """Delete chat messages older than the last `keep` for a user"""
+    cutoff_id = db.session.scalar(
+        db.select(ChatMessage.id).filter_by(user_id=user_id)
+        .order_by(ChatMessage.id.desc()).offset(keep).limit(1)
+    )
+    if cutoff_id:
+        ChatMessage.query.filter(ChatMessage.user_id == user_id, ChatMessage.id <= cutoff_id).delete()
+
+
+def user_source_ids_query():
+    """Subquery selecting the current user's source IDs, for ownership checks in writes"""
+    return db.select(Source.id).where(Source.user_id == current_user.id)
+
+
+def user_content_etag(page: str) -> str | None:
+    """ETag for a user's list page, derived from row counts and last-update timestamps"""
+    # Pending flash messages get rendered into the page, so that version must not be reused
+    if session.get('_flashes'):
+        return None
+
+    source_count, source_updated = db.session.execute(
+        db.select(func.count(Source.id), func.max(Source.updated_at))
+        .where(Source.user_id == current_user.id)
+    ).one()
+    product_count, product_updated = db.session.execute(
+        db.select(func.count(Product.id), func.max(Product.last_updated_at))
+        .where(Product.source_id.in_(user_source_ids_query()))
+    ).one()
+    version = (f"{page}|{current_user.id}|{request.query_string.decode()}|"
+               f"{source_count}|{source_updated}|{product_count}|{product_updated}")
+    return hashlib.sha1(version.encode()).hexdigest()
+
+
+def with_etag(response: Response, etag: str | None) -> Response:
+    """Attach an ETag and make the browser revalidate before reusing the page"""
+    if etag is None:
+        return response
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def not_modified_response(etag: str | None) -> Response | None:
+    """Return a 304 if the client already holds the version identified by etag"""
+    if etag is not None and etag in request.if_none_match:
+        return with_etag(Response(status=304), etag)
+    return None
+
+
+def get_user_source_ids() -> list[int]:
+    """Get IDs of the current user's sources, cached for the request"""
+    if 'user_source_ids' not in g:
+        g.user_source_ids = db.session.scalars(
+            db.select(Source.id).filter_by(user_id=current_user.id)
+        ).all()
+    return g.user_source_ids
+
+
+def get_user_sources() -> list:
+    """Get the current user's sources, cached for the request"""
+    if 'user_sources' not in g:
+        g.user_sources = Source.query.filter_by(user_id=current_user.id).order_by(Source.name).all()
+    return g.user_sources
+
 @bp.route('/')
 def index():
     """Redirect to dashboard if authenticated, otherwise to login"""
@@ -44,33 +148,31 @@ def login():
 @login_required
 def dashboard():
     """Dashboard page - protected route with shopping stats"""
-    # Get stats for dashboard
-    total_sources = Source.query.filter_by(user_id=current_user.id).count()
-    active_sources = Source.query.filter_by(user_id=current_user.id, status='active').count()
-
-    total_products = Product.query.join(Source).filter(Source.user_id == current_user.id).count()
-    favorite_products = Product.query.join(Source).filter(
-        Source.user_id == current_user.id,
-        Product.is_favorite == True
-    ).count()
-
-    # Price drops (products where current price < original price)
-    price_drops = Product.query.join(Source).filter(
-        Source.user_id == current_user.id,
-        Product.original_price.isnot(None),
-        Product.current_price < Product.original_price
-    ).count()
+    # Get stats for dashboard - one aggregate query per table
+    total_sources, active_sources = db.session.query(
+        func.count(Source.id),
+        func.count(Source.id).filter(Source.status == 'active')
+    ).filter(Source.user_id == current_user.id).one()
+
+    # Product queries filter on source_id directly instead of joining sources
+    source_ids = get_user_source_ids()
+
+    # Price drops are products where current price < original price
+    total_products, favorite_products, price_drops = db.session.query(
+        func.count(Product.id),
+        func.count(Product.id).filter(Product.is_favorite == True),
+        func.count(Product.id).filter(Product.is_price_drop == True)
+    ).filter(Product.source_id.in_(source_ids)).one()
 
     # Recent products (last 5)
-    recent_products = Product.query.join(Source).filter(
-        Source.user_id == current_user.id
+    recent_products = Product.query.filter(
+        Product.source_id.in_(source_ids)
     ).order_by(Product.first_seen_at.desc()).limit(5).all()
 
     # Recent price drops (last 5 products with price drops)
-    recent_deals = Product.query.join(Source).filter(
-        Source.user_id == current_user.id,
-        Product.original_price.isnot(None),
-        Product.current_price < Product.original_price
+    recent_deals = Product.query.filter(
+        Product.source_id.in_(source_ids),
+        Product.is_price_drop == True
     ).order_by(Product.last_updated_at.desc()).limit(5).all()
 
     return render_template('dashboard.html',
@@ -86,8 +188,9 @@ def dashboard():
 @login_required
 def logout():
     """Logout user"""
+    ChatMessage.query.filter_by(user_id=current_user.id).delete()
+    db.session.commit()
     logout_user()
-    session.pop('chat_history', None)
     flash('You have been logged out successfully', 'success')
     return redirect(url_for('main.login'))
 
@@ -108,6 +211,7 @@ def settings():
         # Only update API key if it doesn't contain masked characters
         if api_key and '*' not in api_key:
             current_user.settings.set_api_key(api_key)
+            get_anthropic_service.cache_clear()
 
         current_user.settings.selected_model = model
         db.session.commit()
@@ -124,13 +228,13 @@ def settings():
 @login_required
 def chat():
     """Chat page"""
-    if not current_user.settings or not current_user.settings.get_api_key():
+    if not current_user.settings or not current_user.settings.has_api_key():
         flash('Please configure your API key in settings first', 'warning')
         return redirect(url_for('main.settings'))
 
     # Get model label for display
     model = current_user.settings.selected_model
-    model_label = dict(AVAILABLE_MODELS).get(model, model)
+    model_label = MODEL_LABELS.get(model, model)
 
     return render_template('chat.html', current_model_label=model_label)
 
@@ -149,16 +253,19 @@ def test_connection():
     if not api_key:
         return jsonify({'success': False, 'message': 'No API key provided'})
 
-    service = AnthropicService(api_key)
+    service = get_anthropic_service(api_key)
     success, message = service.test_connection()
+    # Persist the cached result of a successful check
+    db.session.commit()
     return jsonify({'success': success, 'message': message})
 
 
 @bp.route('/api/chat', methods=['POST'])
 @login_required
 def api_chat():
-    """API endpoint for chat messages"""
-    if not current_user.settings or not current_user.settings.get_api_key():
+    """API endpoint for chat messages, streams the response with SSE"""
+    api_key = current_user.settings.get_api_key() if current_user.settings else None
+    if not api_key:
         return jsonify({'success': False, 'error': 'API key not configured'})
 
     data = request.get_json()
@@ -167,43 +274,42 @@ def api_chat():
     if not user_message:
         return jsonify({'success': False, 'error': 'Empty message'})
 
-    # Get or initialize chat history
-    if 'chat_history' not in session:
-        session['chat_history'] = []
+    service = get_anthropic_service(api_key)
+    model = current_user.settings.selected_model
+    history = load_chat_history(current_user.id)
+    history.append({'role': 'user', 'content': user_message})
 
-    # Add user message to history
-    session['chat_history'].append({
-        'role': 'user',
-        'content': user_message
-    })
+    def generate():
+        chunks = []
+        try:
+            for text in service.chat_stream(messages=history, model=model):
+                chunks.append(text)
+                yield sse_event({'type': 'delta', 'text': text})
 
-    try:
-        service = AnthropicService(current_user.settings.get_api_key())
-        response = service.chat(
-            messages=session['chat_history'],
-            model=current_user.settings.selected_model
-        )
+            response = ''.join(chunks)
 
-        # Add assistant response to history
-        session['chat_history'].append({
-            'role': 'assistant',
-            'content': response
-        })
-        session.modified = True
+            # Persist both turns only once the exchange succeeded, as one multi-row INSERT
+            db.session.execute(db.insert(ChatMessage), [
+                {'user_id': current_user.id, 'role': 'user', 'content': user_message},
+                {'user_id': current_user.id, 'role': 'assistant', 'content': response},
+            ])
+            trim_chat_history(current_user.id)
+            db.session.commit()
 
-        return jsonify({'success': True, 'response': response})
-    except Exception as e:
-        # Remove the failed user message from history
-        session['chat_history'].pop()
-        session.modified = True
-        return jsonify({'success': False, 'error': str(e)})
+            yield sse_event({'type': 'done', 'response': response})
+        except Exception as e:
+            db.session.rollback()
+            yield sse_event({'type': 'error', 'error': str(e)})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
 
 @bp.route('/api/chat/clear', methods=['POST'])
 @login_required
 def clear_chat():
     """Clear chat history"""
-    session['chat_history'] = []
+    ChatMessage.query.filter_by(user_id=current_user.id).delete()
+    db.session.commit()
     return jsonify({'success': True})
 
 
@@ -215,15 +321,22 @@ def clear_chat():
 @login_required
 def sources():
     """List all sources for current user"""
-    user_sources = Source.query.filter_by(user_id=current_user.id).order_by(Source.created_at.desc()).all()
-    return render_template('sources.html', sources=user_sources)
+    etag = user_content_etag('sources')
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        return not_modified
+
+    user_sources = Source.query.filter_by(user_id=current_user.id).options(
+        undefer(Source.product_count)
+    ).order_by(Source.created_at.desc()).all()
+    return with_etag(make_response(render_template('sources.html', sources=user_sources)), etag)
 
 
 @bp.route('/sources/new', methods=['GET', 'POST'])
 @login_required
 def source_new():
     """Add a new source"""
-    if not current_user.settings or not current_user.settings.get_api_key():
+    if not current_user.settings or not current_user.settings.has_api_key():
         flash('Please configure your API key in settings first', 'warning')
         return redirect(url_for('main.settings'))
 
@@ -240,7 +353,6 @@ def source_new():
         # Parse selectors if provided
         selectors = None
         if selectors_json:
-            import json
             try:
                 selectors = json.loads(selectors_json)
             except json.JSONDecodeError:
@@ -272,7 +384,11 @@ def source_detail(source_id):
     source = Source.query.filter_by(id=source_id, user_id=current_user.id).first_or_404()
     products = Product.query.filter_by(source_id=source_id).order_by(Product.last_updated_at.desc()).limit(50).all()
     sync_logs = SyncLog.query.filter_by(source_id=source_id).order_by(SyncLog.started_at.desc()).limit(10).all()
-    return render_template('source_detail.html', source=source, products=products, sync_logs=sync_logs)
+    product_count = db.session.scalar(
+        db.select(func.count()).select_from(Product).where(Product.source_id == source_id)
+    )
+    return render_template('source_detail.html', source=source, products=products, sync_logs=sync_logs,
+                           product_count=product_count)
 
 
 @bp.route('/sources/<int:source_id>/edit', methods=['GET', 'POST'])
@@ -310,6 +426,15 @@ def source_sync(source_id):
     """Trigger manual sync for a source"""
     source = Source.query.filter_by(id=source_id, user_id=current_user.id).first_or_404()
 
+    # Run in the background so the request doesn't block on scraping and LLM calls
+    queued_log = queue_source_sync(current_app._get_current_object(), source)
+    if queued_log:
+        if queued_log.status == 'failed':
+            flash(f'Sync failed: {queued_log.error_message}', 'danger')
+        else:
+            flash('Sync started in the background', 'info')
+        return redirect(url_for('main.source_detail', source_id=source_id))
+
     try:
         sync_log = sync_source(source)
         if sync_log.status == 'success':
@@ -323,15 +448,33 @@ def source_sync(source_id):
     return redirect(url_for('main.source_detail', source_id=source_id))
 
 
+@bp.route('/api/sync-status/<int:sync_log_id>')
+@login_required
+def api_sync_status(sync_log_id):
+    """Get the status of a sync (for polling background syncs)"""
+    sync_log = SyncLog.query.join(Source).filter(
+        SyncLog.id == sync_log_id,
+        Source.user_id == current_user.id
+    ).first_or_404()
+
+    return jsonify({
+        'success': True,
+        'status': sync_log.status,
+        'products_found': sync_log.products_found,
+        'products_added': sync_log.products_added,
+        'products_updated': sync_log.products_updated,
+        'error_message': sync_log.error_message
+    })
+
+
 @bp.route('/api/analyze-url', methods=['POST'])
 @login_required
 def api_analyze_url():
     """Analyze a URL and return detected products preview with SSE streaming"""
-    from flask import Response, stream_with_context
-    import json as json_module
-
-    if not current_user.settings or not current_user.settings.get_api_key():
+    api_key = current_user.settings.get_api_key() if current_user.settings else None
+    if not api_key:
         return jsonify({'success': False, 'error': 'API key not configured'})
+    model = current_user.settings.selected_model or 'claude-3-5-haiku-latest'
 
     data = request.get_json()
     url = data.get('url', '').strip()
@@ -341,53 +484,69 @@ def api_analyze_url():
 
     def generate():
         def send_progress(message, status='progress'):
-            return f"data: {json_module.dumps({'type': status, 'message': message})}\n\n"
-
+            return sse_event({'type': status, 'message': message})
+
+        # If the client disconnects, the server closes this generator: GeneratorExit is raised at the
+        # pending yield (it is not an Exception, so the handler below lets it through) and the
+        # finally block releases work still in flight.
+        js_future = None
+        selector_stream = None
+        llm_stream = None
         try:
             yield send_progress(f"Starting analysis for {url}")
 
-            # Import services
-            from app.services.scraper_service import ScraperService
-            from app.services.html_fetcher_service import HtmlFetcherService
-
-            api_key = current_user.settings.get_api_key()
-            model = current_user.settings.selected_model or 'claude-3-5-haiku-latest'
-
             # Step 1: Fetch HTML
             yield send_progress("Fetching page content...")
             fetcher = HtmlFetcherService()
 
+            # The browser fetch holds one of BrowserPool's few slots for a full page load and can't be
+            # stopped once running, so it only starts when needed: the static fetch failed or looks thin,
+            # or it is still pending after a short grace period (a slow static fetch often ends in a timeout)
             yield send_progress("Trying static HTTP request...")
-            html, error = fetcher.fetch_static(url)
+            executor = ThreadPoolExecutor(max_workers=2)
+            static_future = executor.submit(fetcher.fetch_static, url)
+            try:
+                static_future.result(timeout=BROWSER_FETCH_GRACE)
+            except FuturesTimeoutError:
+                yield send_progress("Static request is slow, starting headless browser in parallel...")
+                js_future = executor.submit(fetcher.fetch_with_javascript, url)
+
+            html, error = static_future.result()
 
             # Fall back to Playwright on HTTP errors, timeouts, connection errors, or CAPTCHA
-            if error and ('HTTP error' in error or 'CAPTCHA' in error or 'timed out' in error or 'connect' in error.lower()):
+            static_failed = bool(error) and (
+                'HTTP error' in error or 'CAPTCHA' in error or 'timed out' in error or 'connect' in error.lower()
+            )
+            thin_page = bool(html) and fetcher.visible_text_length(html, cap=500) < 500
+            if js_future is None and (static_failed or thin_page):
+                js_future = executor.submit(fetcher.fetch_with_javascript, url)
+            executor.shutdown(wait=False)
+
+            if static_failed:
                 yield send_progress(f"Static fetch failed: {error}")
-                yield send_progress("Launching headless browser (Playwright stealth mode)...")
-                html, error = fetcher.fetch_with_javascript(url)
+                yield send_progress("Waiting for headless browser (Playwright stealth mode)...")
+                html, error = js_future.result()
 
                 if html:
                     yield send_progress(f"Browser fetch successful! Got {len(html):,} bytes")
                 else:
                     yield send_progress(f"Browser fetch also failed: {error}", 'error')
-                    yield f"data: {json_module.dumps({'type': 'error', 'error': error})}\n\n"
+                    yield sse_event({'type': 'error', 'error': error})
                     return
             elif html:
                 yield send_progress(f"Static fetch successful! Got {len(html):,} bytes")
 
                 # Check if JS might be needed
-                from bs4 import BeautifulSoup
-                soup = BeautifulSoup(html, 'lxml')
-                body_text = soup.get_text(strip=True)
-                if len(body_text) < 500:
-                    yield send_progress("Page content seems thin, trying browser...")
-                    js_html, _ = fetcher.fetch_with_javascript(url)
+                if thin_page:
+                    yield send_progress("Page content seems thin, waiting for browser...")
+                    js_html, _ = js_future.result()
                     if js_html and len(js_html) > len(html):
                         html = js_html
                         yield send_progress(f"Browser got more content: {len(html):,} bytes")
+                    del js_html
             else:
                 yield send_progress(f"Fetch failed: {error}", 'error')
-                yield f"data: {json_module.dumps({'type': 'error', 'error': error})}\n\n"
+                yield sse_event({'type': 'error', 'error': error})
                 return
 
             # Step 2: Clean HTML
@@ -397,8 +556,7 @@ def api_analyze_url():
             # Report cleaning results
             if '<!-- Found' in cleaned_html and 'product-samples' in cleaned_html:
                 # Extract product count from comment
-                import re
-                match = re.search(r'Found (\d+) products, showing (\d+)', cleaned_html)
+                match = SAMPLES_COMMENT_RE.search(cleaned_html)
                 if match:
                     yield send_progress(f"Large page - found {match.group(1)} products, using {match.group(2)} samples")
             yield send_progress(f"Cleaned HTML: {len(cleaned_html):,} chars (~{len(cleaned_html)//4:,} tokens)")
@@ -408,7 +566,19 @@ def api_analyze_url():
             yield send_progress("AI is analyzing page structure and generating selectors...")
 
             scraper = ScraperService(api_key=api_key, model=model)
-            selectors, error = scraper.analyze_url_with_html(url, cleaned_html)
+
+            # Stream the selector response so the client sees progress instead of a silent wait
+            selector_stream = scraper.analyze_url_with_html_stream(url, cleaned_html)
+            reported = 0
+            while True:
+                try:
+                    received = next(selector_stream)
+                except StopIteration as stop:
+                    selectors, error = stop.value
+                    break
+                if received - reported >= 250:
+                    reported = received
+                    yield send_progress(f"Receiving selectors from Claude... {received:,} chars")
 
             if error:
                 yield send_progress(f"Selector generation failed: {error}", 'error')
@@ -417,16 +587,34 @@ def api_analyze_url():
             # Step 4: Extract products
             yield send_progress("Extracting products using detected patterns...")
 
+            products = []
             if selectors and not selectors.get('use_llm_extraction'):
                 products = scraper._extract_with_selectors(html, selectors, url)
                 yield send_progress(f"Selector-based extraction found {len(products)} products")
+                # Only selectors that actually extract products are cached for this page
+                if products:
+                    scraper.confirm_selectors()
+                else:
+                    scraper.reject_selectors()
 
                 if not products:
                     yield send_progress("No products with selectors, trying direct LLM extraction...")
-                    products, _ = scraper._extract_with_llm(cleaned_html, url)
             else:
                 yield send_progress("Using direct LLM extraction...")
-                products, _ = scraper._extract_with_llm(cleaned_html, url)
+
+            if not products:
+                # Products arrive one by one while Claude is still writing the rest of the list
+                llm_stream = scraper._extract_with_llm_stream(html, url, cleaned_html=cleaned_html)
+                for product in llm_stream:
+                    products.append(product)
+                    if len(products) % 5 == 0:
+                        yield send_progress(f"Receiving products from Claude... {len(products)} so far")
+
+            # Persist the LLM responses cached while analyzing
+            db.session.commit()
+
+            # The page HTML is no longer needed; drop it before the remaining frames are sent
+            del html, cleaned_html
 
             yield send_progress(f"Found {len(products)} products!", 'success')
             yield send_progress(f"Used {scraper.get_tokens_used():,} API tokens")
@@ -442,11 +630,20 @@ def api_analyze_url():
                 products_serializable.append(product)
 
             # Send final result
-            yield f"data: {json_module.dumps({'type': 'complete', 'success': True, 'selectors': selectors, 'products': products_serializable, 'tokens_used': scraper.get_tokens_used()})}\n\n"
+            yield sse_event({'type': 'complete', 'success': True, 'selectors': selectors, 'products': products_serializable, 'tokens_used': scraper.get_tokens_used()})
 
         except Exception as e:
             yield send_progress(f"Error: {str(e)}", 'error')
-            yield f"data: {json_module.dumps({'type': 'error', 'error': str(e)})}\n\n"
+            yield sse_event({'type': 'error', 'error': str(e)})
+        finally:
+            # Closing the Claude streams aborts an in-flight response;
+            # cancel() drops the browser fetch if it hasn't started yet
+            if selector_stream is not None:
+                selector_stream.close()
+            if llm_stream is not None:
+                llm_stream.close()
+            if js_future is not None:
+                js_future.cancel()
 
     return Response(stream_with_context(generate()), mimetype='text/event-stream')
 
@@ -465,8 +662,17 @@ def products():
     sort_by = request.args.get('sort', 'updated')
     search = request.args.get('search', '').strip()
 
-    # Base query - join with sources to filter by user
-    query = Product.query.join(Source).filter(Source.user_id == current_user.id)
+    page = request.args.get('page', 1, type=int)
+
+    etag = user_content_etag('products')
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        return not_modified
+
+    # Base query - join with sources to filter by user, reusing the join to load product.source
+    query = Product.query.join(Source).filter(Source.user_id == current_user.id).options(
+        contains_eager(Product.source)
+    )
 
     # Apply filters
     if filter_type == 'favorites':
@@ -475,15 +681,13 @@ def products():
         query = query.filter(Product.is_available == False)
     elif filter_type == 'price_drops':
         # Products where current price < original price
-        query = query.filter(
-            Product.original_price.isnot(None),
-            Product.current_price < Product.original_price
-        )
+        query = query.filter(Product.is_price_drop == True)
 
     if source_id:
         query = query.filter(Product.source_id == source_id)
 
     if search:
+        # Served by the pg_trgm GIN index on products.name
         query = query.filter(Product.name.ilike(f'%{search}%'))
 
     # Apply sorting
@@ -498,18 +702,16 @@ def products():
     else:  # default: updated
         query = query.order_by(Product.last_updated_at.desc())
 
-    products_list = query.limit(100).all()
+    pagination = query.paginate(page=page, per_page=PRODUCTS_PER_PAGE, error_out=False)
 
-    # Get user's sources for filter dropdown
-    sources_list = Source.query.filter_by(user_id=current_user.id).all()
-
-    return render_template('products.html',
-                          products=products_list,
-                          sources=sources_list,
+    return with_etag(make_response(render_template('products.html',
+                          products=pagination.items,
+                          pagination=pagination,
+                          sources=get_user_sources(),
                           current_filter=filter_type,
                           current_source_id=source_id,
                           current_sort=sort_by,
-                          search=search)
+                          search=search)), etag)
 
 
 @bp.route('/products/<int:product_id>')
@@ -531,16 +733,20 @@ def product_detail(product_id):
 @login_required
 def product_toggle_favorite(product_id):
     """Toggle favorite status for a product"""
-    product = Product.query.join(Source).filter(
-        Product.id == product_id,
-        Source.user_id == current_user.id
-    ).first_or_404()
-
-    product.is_favorite = not product.is_favorite
+    # Single UPDATE ... RETURNING, scoped to the user's sources
+    is_favorite = db.session.execute(
+        db.update(Product)
+        .where(Product.id == product_id, Product.source_id.in_(user_source_ids_query()))
+        .values(is_favorite=~Product.is_favorite)
+        .returning(Product.is_favorite)
+        .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+    if is_favorite is None:
+        abort(404)
     db.session.commit()
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return jsonify({'success': True, 'is_favorite': product.is_favorite})
+        return jsonify({'success': True, 'is_favorite': is_favorite})
 
     flash('Favorite status updated', 'success')
     return redirect(url_for('main.product_detail', product_id=product_id))
@@ -550,13 +756,15 @@ def product_toggle_favorite(product_id):
 @login_required
 def product_update_notes(product_id):
     """Update product notes"""
-    product = Product.query.join(Source).filter(
-        Product.id == product_id,
-        Source.user_id == current_user.id
-    ).first_or_404()
-
     data = request.get_json()
-    product.user_notes = data.get('notes', '')
+    result = db.session.execute(
+        db.update(Product)
+        .where(Product.id == product_id, Product.source_id.in_(user_source_ids_query()))
+        .values(user_notes=data.get('notes', ''))
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        abort(404)
     db.session.commit()
 
     return jsonify({'success': True})
@@ -566,12 +774,25 @@ def product_update_notes(product_id):
 @login_required
 def product_delete(product_id):
     """Delete a product"""
-    product = Product.query.join(Source).filter(
+    owned_product = db.select(Product.id).where(
         Product.id == product_id,
-        Source.user_id == current_user.id
-    ).first_or_404()
-
-    db.session.delete(product)
+        Product.source_id.in_(user_source_ids_query())
+    )
+
+    # Price history first (no ON DELETE CASCADE in the schema), then the product
+    db.session.execute(
+        db.delete(PriceHistory)
+        .where(PriceHistory.product_id.in_(owned_product))
+        .execution_options(synchronize_session=False)
+    )
+    result = db.session.execute(
+        db.delete(Product)
+        .where(Product.id.in_(owned_product))
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db.session.rollback()
+        abort(404)
     db.session.commit()
 
     flash('Product deleted', 'success')
@@ -581,21 +802,32 @@ def product_delete(product_id):
 @bp.route('/api/products/<int:product_id>/history')
 @login_required
 def api_product_history(product_id):
-    """Get price history for a product (for charts)"""
+    """Get price history for a product (for charts), down-sampled to daily or weekly buckets"""
     product = Product.query.join(Source).filter(
         Product.id == product_id,
         Source.user_id == current_user.id
     ).first_or_404()
 
-    history = PriceHistory.query.filter_by(product_id=product_id).order_by(PriceHistory.recorded_at.asc()).all()
-
-    return jsonify({
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in ('day', 'week'):
+        bucket = 'day'
+
+    period = func.date_trunc(bucket, PriceHistory.recorded_at).label('period')
+    rows = db.session.query(
+        period,
+        func.min(PriceHistory.price),
+        func.avg(PriceHistory.price),
+        func.max(PriceHistory.price)
+    ).filter(PriceHistory.product_id == product.id).group_by(period).order_by(period).all()
+
+    # Compact [period, min, avg, max] rows instead of one object per record;
+    # orjson serializes the datetimes natively
+    return Response(orjson.dumps({
         'success': True,
+        'bucket': bucket,
+        'columns': ['period', 'min', 'avg', 'max'],
         'history': [
-            {
-                'price': float(h.price),
-                'recorded_at': h.recorded_at.isoformat()
-            }
-            for h in history
+            [row[0], float(row[1]), round(float(row[2]), 2), float(row[3])]
+            for row in rows
         ]
-    })
+    }), mimetype='application/json')
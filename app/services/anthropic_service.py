@@ -1,5 +1,14 @@
+import logging
+import threading
+from functools import lru_cache
+
 import anthropic
-from typing import Optional
+import httpx
+from typing import Iterator, Optional
+
+from app.services import llm_cache
+
+logger = logging.getLogger(__name__)
 
 AVAILABLE_MODELS = [
     ('claude-3-5-haiku-latest', 'Claude 3.5 Haiku (Fast)'),
@@ -7,21 +16,72 @@ AVAILABLE_MODELS = [
     ('claude-opus-4-5-20250514', 'Claude Opus 4.5 (Most Capable)')
 ]
 
+# Model id -> display label, built once (AVAILABLE_MODELS keeps the order for the settings dropdown)
+MODEL_LABELS = dict(AVAILABLE_MODELS)
+
+# Shared HTTP connection pool so TCP/TLS connections to the API are reused across requests.
+# The API key is sent per request, so one pool serves every user.
+# Idle connections are kept for a minute (httpx default is 5s) since LLM calls in a sync are seconds apart.
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def get_http_client() -> httpx.Client:
+    """Get the shared httpx client used by all Anthropic clients"""
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = anthropic.DefaultHttpxClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60)
+            )
+        return _http_client
+
+
+def build_cached_request(messages: list, system: Optional[str] = None) -> dict:
+    """
+    Build messages/system request arguments with prompt-cache breakpoints.
+    The system prompt and everything up to the turn before the newest user
+    message are stable between chat turns, so they are marked cacheable.
+    """
+    request = {'messages': list(messages)}
+
+    if system:
+        request['system'] = [{'type': 'text', 'text': system, 'cache_control': {'type': 'ephemeral'}}]
+
+    # Breakpoint on the last message before the new user turn
+    if len(messages) >= 2:
+        stable = dict(messages[-2])
+        content = stable['content']
+        if isinstance(content, str):
+            content = [{'type': 'text', 'text': content}]
+        content = [dict(block) for block in content]
+        content[-1]['cache_control'] = {'type': 'ephemeral'}
+        stable['content'] = content
+        request['messages'][-2] = stable
+
+    return request
+
 
 class AnthropicService:
     """Service class for Anthropic API interactions"""
 
     def __init__(self, api_key: str):
-        self.client = anthropic.Anthropic(api_key=api_key)
+        self.client = anthropic.Anthropic(api_key=api_key, http_client=get_http_client())
 
-    def test_connection(self) -> tuple[bool, str]:
+    def test_connection(self, model: str = "claude-3-5-haiku-latest") -> tuple[bool, str]:
         """Test if the API key is valid by making a minimal request"""
+        # Successful checks are cached per key, so repeated settings saves don't burn API calls
+        cache_key = llm_cache.make_key('test', api_key=self.client.api_key, model=model)
+        if llm_cache.get(cache_key, ttl=3600):
+            return True, "Connection successful"
+
         try:
             response = self.client.messages.create(
-                model="claude-3-5-haiku-latest",
+                model=model,
                 max_tokens=10,
                 messages=[{"role": "user", "content": "Hi"}]
             )
+            llm_cache.set(cache_key, "ok")
             return True, "Connection successful"
         except anthropic.AuthenticationError:
             return False, "Invalid API key"
@@ -32,11 +92,39 @@ class AnthropicService:
         except Exception as e:
             return False, f"Error: {str(e)}"
 
-    def chat(self, messages: list, model: str, max_tokens: int = 4096) -> str:
+    def chat(self, messages: list, model: str, max_tokens: int = 4096, system: Optional[str] = None) -> str:
         """Send a chat message and return the response"""
         response = self.client.messages.create(
             model=model,
             max_tokens=max_tokens,
-            messages=messages
+            **build_cached_request(messages, system)
         )
+        self._log_cache_usage(response.usage)
         return response.content[0].text
+
+    def chat_stream(self, messages: list, model: str, max_tokens: int = 4096,
+                    system: Optional[str] = None) -> Iterator[str]:
+        """Send a chat message and yield the response text as it is generated"""
+        with self.client.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            **build_cached_request(messages, system)
+        ) as stream:
+            for text in stream.text_stream:
+                yield text
+            self._log_cache_usage(stream.get_final_message().usage)
+
+    def _log_cache_usage(self, usage):
+        """Log prompt cache hits for verification"""
+        logger.debug(
+            "Prompt cache: %s read, %s written, %s uncached input tokens",
+            getattr(usage, 'cache_read_input_tokens', 0),
+            getattr(usage, 'cache_creation_input_tokens', 0),
+            usage.input_tokens
+        )
+
+
+@lru_cache(maxsize=64)
+def get_anthropic_service(api_key: str) -> AnthropicService:
+    """Get a reusable AnthropicService for an API key"""
+    return AnthropicService(api_key)
@@ -1,11 +1,26 @@
+import asyncio
+import atexit
+import http.cookiejar
 import random
+import re
+import threading
 import time
 import logging
+from functools import lru_cache
 from typing import Optional
 from urllib.parse import urlparse
 
+import lxml.html
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from lxml.cssselect import CSSSelector, LxmlHTMLTranslator
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from playwright.async_api import async_playwright
+except ImportError:  # Optional: without it only static fetches are available
+    async_playwright = None
 
 logger = logging.getLogger(__name__)
 
@@ -18,143 +33,462 @@ USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36 Edg/120.0.0.0',
 ]
 
+# Chromium flags for the shared headless browser
+BROWSER_ARGS = [
+    '--disable-blink-features=AutomationControlled',
+    '--disable-dev-shm-usage',
+    '--no-sandbox',
+    '--disable-gpu',
+    '--disable-extensions',
+    '--mute-audio',
+]
+
+# Scripts injected into every page to avoid automation detection
+STEALTH_SCRIPT = """
+    // Overwrite the 'webdriver' property to return undefined
+    Object.defineProperty(navigator, 'webdriver', {
+        get: () => undefined
+    });
+
+    // Overwrite plugins to look more realistic
+    Object.defineProperty(navigator, 'plugins', {
+        get: () => [1, 2, 3, 4, 5]
+    });
+
+    // Overwrite languages
+    Object.defineProperty(navigator, 'languages', {
+        get: () => ['en-US', 'en']
+    });
+"""
+
+# Patterns for estimating visible text length without building a DOM.
+# Each match is an invisible block, a tag, or a run of text (group 2).
+_TEXT_SEGMENT_RE = re.compile(
+    r'<(script|style|noscript|template|head)\b[^>]*>.*?</\1\s*>|<[^>]*>|([^<]+)',
+    re.IGNORECASE | re.DOTALL
+)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# CAPTCHA / bot-wall markers, matched case-insensitively in one pass over the page
+_CAPTCHA_RE = re.compile(
+    r'captcha|recaptcha|hcaptcha|challenge-form|bot-detection|'
+    r'verify you are human|are you a robot|prove you are not a robot',
+    re.IGNORECASE
+)
+
+# Text suggesting the static page is a shell that needs JavaScript to render
+_JS_REQUIRED_RE = re.compile(
+    r'enable javascript|javascript is required|please enable javascript|loading\.\.\.',
+    re.IGNORECASE
+)
+
+# Selectors used by clean_html_for_llm
+# Non-product sections to drop (careful not to match body or main content containers)
+NOISE_SELECTORS = (
+    'header', 'footer', 'nav',
+    'div[class*="cookie"]', 'div[class*="newsletter"]',
+    'div[class*="popup"]', 'div[class*="modal"]',
+    'aside[class*="banner"]', 'div[id*="cookie"]',
+    '.didomi-popup-container', '.didomi-popup-backdrop',
+)
+NOISE_KEEP_SELECTOR = '[class*="product"], [data-sku], [data-product]'
+# Candidate product listing areas, in priority order
+PRODUCT_AREA_SELECTORS = (
+    '[class*="plp"]', '[class*="product-list"]', '[class*="product-grid"]',
+    '[class*="listing"]', 'main', '[role="main"]', '[class*="results"]',
+)
+PRODUCT_AREA_ITEM_SELECTOR = '[data-sku], [data-product], [class*="product"], [class*="card"]'
+# Product-like containers (including modern React/Next.js patterns)
+PRODUCT_CONTAINER_SELECTOR = (
+    '[data-sku], [data-product-id], [data-pid], [data-item-id], '
+    '[class*="product-card"], [class*="product-tile"], [class*="product-item"], '
+    '[class*="productCard"], [class*="ProductCard"], [class*="ProductGrid_grid_item"], '
+    '[class*="_product_card"], [class*="product_card"], [class*="grid_item_wrapper"], '
+    '[class*="ProductTile"], [class*="product-listing"], [class*="plp-product"]'
+)
+# Attributes kept when stripping markup down to the essentials
+ESSENTIAL_ATTRS = frozenset((
+    'class', 'id', 'href', 'src', 'data-src', 'alt', 'title',
+    'data-sku', 'data-product', 'data-price', 'aria-label',
+))
+# Structural skeleton for selector generation: these attributes plus any data-*/aria-* are kept,
+# text and long attribute values are cut short (class and id stay whole, selectors are built from them)
+SKELETON_ATTRS = frozenset(('class', 'id', 'href', 'src'))
+SKELETON_WHOLE_ATTRS = frozenset(('class', 'id'))
+SKELETON_TEXT_CHARS = 20
+SKELETON_VALUE_CHARS = 60
+# Repeated siblings (same tag and class) kept per parent; a grid of 100 identical cards needs only a few
+SKELETON_MAX_SIMILAR = 10
+
+# Compiled once: lxml evaluates these in C without building a Python object per node
+_STRIP_ELEMENTS_XPATH = etree.XPath('//script | //style | //noscript | //iframe | //svg | //head')
+_STYLED_XPATH = etree.XPath('//*[@style]')
+_HIDDEN_XPATH = etree.XPath('//*[@hidden]')
+_NOISE_CSS = tuple(CSSSelector(selector, translator='html') for selector in NOISE_SELECTORS)
+_NOISE_KEEP_CSS = CSSSelector(NOISE_KEEP_SELECTOR, translator='html')
+# Product area lookup: one traversal with the combined selector, then rank the (few) matches by priority
+_PRODUCT_AREA_ANY_CSS = CSSSelector(', '.join(PRODUCT_AREA_SELECTORS), translator='html')
+_PRODUCT_AREA_SELF_XPATHS = tuple(
+    etree.XPath(LxmlHTMLTranslator().css_to_xpath(selector, prefix='self::'))
+    for selector in PRODUCT_AREA_SELECTORS
+)
+_PRODUCT_AREA_ITEM_CSS = CSSSelector(PRODUCT_AREA_ITEM_SELECTOR, translator='html')
+_PRODUCT_CONTAINER_CSS = CSSSelector(PRODUCT_CONTAINER_SELECTOR, translator='html')
+
+
+def parse_html(html: str):
+    """
+    Parse a page into an lxml document tree, dropping comments.
+    Parsed from UTF-8 bytes so pages with an XML encoding declaration are accepted.
+    huge_tree lifts libxml2's nesting depth and text size limits, which deeply nested
+    app-rendered pages can hit (the parser would otherwise stop and return a truncated tree).
+    """
+    parser = lxml.html.HTMLParser(encoding='utf-8', remove_comments=True, huge_tree=True)
+    return lxml.html.document_fromstring(html.encode('utf-8', errors='replace'), parser=parser)
+
+
+def _iter_visible_text(html: str):
+    """
+    Yield (text, length) for each run of visible text in html, without parsing it into a tree.
+    Whitespace in text is collapsed to single spaces; length counts only the non-whitespace characters.
+    """
+    for match in _TEXT_SEGMENT_RE.finditer(html):
+        text = match.group(2)
+        if text:
+            text = _WHITESPACE_RE.sub(' ', text).strip()
+            if text:
+                yield text, len(text) - text.count(' ')
+
+
+def _shorten(value: Optional[str], limit: int) -> Optional[str]:
+    """Whitespace-only text becomes None, longer text is cut to limit characters"""
+    if value is None:
+        return None
+    value = value.strip()
+    if not value:
+        return None
+    return value if len(value) <= limit else value[:limit] + '...'
+
+
+def _drop(element):
+    """Remove an element and its children, keeping its tail text"""
+    if element.getparent() is not None:
+        element.drop_tree()
+
+
+@lru_cache(maxsize=2048)
+def _cached_urlparse(url: str):
+    """urlparse for URLs seen over and over (page base URLs); the result is an immutable namedtuple"""
+    return urlparse(url)
+
+
+@lru_cache(maxsize=2048)
+def _cached_origin(base_url: str) -> str:
+    """scheme://netloc of a base URL, split once per page instead of once per product link"""
+    parsed = _cached_urlparse(base_url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def _find_product_area(root):
+    """Return the first element matching the highest-priority product area selector"""
+    best, best_rank = None, len(_PRODUCT_AREA_SELF_XPATHS)
+    for element in _PRODUCT_AREA_ANY_CSS(root):
+        for rank, matches in enumerate(_PRODUCT_AREA_SELF_XPATHS[:best_rank]):
+            if matches(element):
+                best, best_rank = element, rank
+                break
+        if best_rank == 0:
+            break
+    return best
+
+
+def _to_html(element) -> str:
+    """Serialize an element (without its tail text) to an HTML string"""
+    return etree.tostring(element, encoding='unicode', method='html', with_tail=False)
+
+
+class BrowserPool:
+    """
+    Keeps one headless Chromium warm for JavaScript fetches.
+    Launching the browser is the expensive part (1-3s), so it is shared and each
+    fetch gets its own cheap BrowserContext. Playwright runs on a dedicated
+    asyncio thread, so Flask and scheduler threads can all submit work to it.
+    """
+
+    def __init__(self, max_instances: int = 3, idle_timeout: float = 300):
+        self.max_instances = max_instances  # Concurrent contexts, extra fetches queue
+        self.idle_timeout = idle_timeout  # Seconds before an unused browser is closed
+        self._lock = threading.Lock()
+        self._loop = None
+        self._playwright = None
+        self._browser = None
+        self._semaphore = None
+        self._launch_lock = None
+        self._active = 0
+        self._last_used = 0.0
+
+    def run(self, fn, *args):
+        """Run `await fn(browser, *args)` on the pool thread and return its result"""
+        return asyncio.run_coroutine_threadsafe(self._run(fn, *args), self._get_loop()).result()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Start the pool's event loop thread on first use"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='browser-pool', daemon=True).start()
+            return self._loop
+
+    async def _run(self, fn, *args):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_instances)
+            self._launch_lock = asyncio.Lock()
+
+        async with self._semaphore:
+            self._active += 1
+            try:
+                browser = await self._get_browser()
+                return await fn(browser, *args)
+            finally:
+                self._active -= 1
+                self._last_used = self._loop.time()
+                self._loop.call_later(self.idle_timeout, self._close_if_idle)
+
+    async def _get_browser(self):
+        """Launch the browser if it is not running"""
+        async with self._launch_lock:
+            if self._browser is None or not self._browser.is_connected():
+                if self._playwright is None:
+                    self._playwright = await async_playwright().start()
+                logger.info("Launching shared headless browser")
+                self._browser = await self._playwright.chromium.launch(headless=True, args=BROWSER_ARGS)
+            return self._browser
+
+    def _close_if_idle(self):
+        if self._active == 0 and self._loop.time() - self._last_used >= self.idle_timeout:
+            self._loop.create_task(self._close())
+
+    async def _close(self):
+        if self._browser is not None:
+            logger.info("Closing idle headless browser")
+            browser, self._browser = self._browser, None
+            await browser.close()
+
+    def shutdown(self, timeout: float = 10):
+        """Close the browser and Playwright, then stop the pool thread"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(timeout)
+        except Exception as e:
+            logger.warning(f"Error shutting down browser pool: {e}")
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+
+    async def _shutdown(self):
+        await self._close()
+        if self._playwright is not None:
+            playwright, self._playwright = self._playwright, None
+            await playwright.stop()
+
+
+# Global browser pool instance
+browser_pool = None
+_browser_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    """Get or create the browser pool instance"""
+    global browser_pool
+    with _browser_pool_lock:
+        if browser_pool is None:
+            browser_pool = BrowserPool()
+            # Don't leave Chromium processes behind when the worker exits
+            atexit.register(browser_pool.shutdown)
+        return browser_pool
+
+
+# Static fetches stop reading after this many bytes; larger pages are truncated
+MAX_PAGE_BYTES = 2 * 1024 * 1024
+
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+# Only advertise brotli when urllib3 can decode it
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+# Shared HTTP session so keep-alive connections are reused across fetchers and sync workers
+http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """Get or create the shared HTTP session for static fetches"""
+    global http_session
+    with _http_session_lock:
+        if http_session is None:
+            session = requests.Session()
+            # Retry transient upstream errors here rather than falling through to the (much slower) browser fetch.
+            # Retry-After is ignored so a rate-limited site can't stall a sync worker for minutes.
+            retries = Retry(
+                total=2,
+                backoff_factor=0.3,
+                status_forcelist=[429, 502, 503, 504],
+                allowed_methods=['GET'],
+                respect_retry_after_header=False,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=50, pool_maxsize=50, max_retries=retries)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers.update({
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+                'Accept-Language': 'en-US,en;q=0.5',
+                'Accept-Encoding': ACCEPT_ENCODING,
+                'DNT': '1',
+                'Connection': 'keep-alive',
+                'Upgrade-Insecure-Requests': '1',
+            })
+            # Don't accumulate site cookies across unrelated fetches (redirect chains still carry theirs)
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            http_session = session
+        return http_session
+
 
 class HtmlFetcherService:
     """Service for fetching HTML content from shopping websites"""
 
     def __init__(self, use_javascript: bool = False):
         self.use_javascript = use_javascript
-        self.session = requests.Session()
-        self._setup_session()
-
-    def _setup_session(self):
-        """Configure session with default headers"""
-        self.session.headers.update({
-            'User-Agent': random.choice(USER_AGENTS),
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-        })
+        self.session = get_http_session()
 
     def _random_delay(self, min_seconds: float = 1.0, max_seconds: float = 3.0):
         """Add random delay between requests to appear more human-like"""
         delay = random.uniform(min_seconds, max_seconds)
         time.sleep(delay)
 
-    def _rotate_user_agent(self):
-        """Rotate to a new user agent"""
-        self.session.headers['User-Agent'] = random.choice(USER_AGENTS)
-
     def fetch_static(self, url: str, timeout: int = 30) -> tuple[Optional[str], Optional[str]]:
         """
         Fetch HTML using requests (static content only).
         Returns (html_content, error_message)
         """
         try:
-            self._rotate_user_agent()
-            response = self.session.get(url, timeout=timeout, allow_redirects=True)
-            response.raise_for_status()
+            # User agent is rotated per request, since the session is shared
+            with self.session.get(
+                url,
+                headers={'User-Agent': random.choice(USER_AGENTS)},
+                timeout=timeout,
+                allow_redirects=True,
+                stream=True
+            ) as response:
+                if response.status_code >= 400:
+                    return None, f"HTTP error: {response.status_code}"
+                html = self._read_capped(response)
 
             # Check for CAPTCHA indicators
-            if self._detect_captcha(response.text):
+            if self._detect_captcha(html):
                 return None, "CAPTCHA detected - site may be blocking automated access"
 
-            return response.text, None
+            return html, None
 
         except requests.exceptions.Timeout:
             return None, f"Request timed out after {timeout} seconds"
         except requests.exceptions.ConnectionError:
             return None, "Failed to connect to the website"
-        except requests.exceptions.HTTPError as e:
-            return None, f"HTTP error: {e.response.status_code}"
         except Exception as e:
             return None, f"Error fetching page: {str(e)}"
 
+    def _read_capped(self, response: requests.Response) -> str:
+        """Read a streamed response body up to MAX_PAGE_BYTES and decode it"""
+        chunks = []
+        total = 0
+        for chunk in response.iter_content(chunk_size=65536):
+            chunks.append(chunk)
+            total += len(chunk)
+            if total >= MAX_PAGE_BYTES:
+                logger.info(f"Page exceeds {MAX_PAGE_BYTES:,} bytes, truncating: {response.url}")
+                break
+        body = b''.join(chunks)[:MAX_PAGE_BYTES]
+
+        # Charset from the Content-Type header, else a <meta charset> near the top, else UTF-8.
+        # (response.text would run charset detection over the whole body when the header has none.)
+        encoding = None
+        if 'charset=' in response.headers.get('Content-Type', '').lower():
+            encoding = response.encoding
+        if not encoding:
+            match = _META_CHARSET_RE.search(body, 0, 4096)
+            encoding = match.group(1).decode('ascii') if match else 'utf-8'
+        try:
+            return body.decode(encoding, errors='replace')
+        except LookupError:
+            return body.decode('utf-8', errors='replace')
+
     def fetch_with_javascript(self, url: str, timeout: int = 60000) -> tuple[Optional[str], Optional[str]]:
         """
         Fetch HTML using Playwright for JavaScript-rendered content.
         Returns (html_content, error_message)
         """
+        if async_playwright is None:
+            return None, "Playwright not installed"
         try:
-            from playwright.sync_api import sync_playwright
-
-            with sync_playwright() as p:
-                # Launch with stealth settings
-                browser = p.chromium.launch(
-                    headless=True,
-                    args=[
-                        '--disable-blink-features=AutomationControlled',
-                        '--disable-dev-shm-usage',
-                        '--no-sandbox',
-                    ]
-                )
-
-                # Create context with realistic browser fingerprint
-                context = browser.new_context(
-                    user_agent=random.choice(USER_AGENTS),
-                    viewport={'width': 1920, 'height': 1080},
-                    locale='en-US',
-                    timezone_id='America/New_York',
-                    geolocation={'latitude': 40.7128, 'longitude': -74.0060},
-                    permissions=['geolocation'],
-                    java_script_enabled=True,
-                    bypass_csp=True,
-                    extra_http_headers={
-                        'Accept-Language': 'en-US,en;q=0.9',
-                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-                    }
-                )
-
-                page = context.new_page()
-
-                # Add stealth scripts to avoid detection
-                page.add_init_script("""
-                    // Overwrite the 'webdriver' property to return undefined
-                    Object.defineProperty(navigator, 'webdriver', {
-                        get: () => undefined
-                    });
-
-                    // Overwrite plugins to look more realistic
-                    Object.defineProperty(navigator, 'plugins', {
-                        get: () => [1, 2, 3, 4, 5]
-                    });
-
-                    // Overwrite languages
-                    Object.defineProperty(navigator, 'languages', {
-                        get: () => ['en-US', 'en']
-                    });
-                """)
-
-                # Navigate with realistic behavior
-                try:
-                    page.goto(url, timeout=timeout, wait_until='domcontentloaded')
-                except Exception:
-                    # Try with less strict wait condition
-                    page.goto(url, timeout=timeout, wait_until='commit')
-
-                # Wait for content to load
-                page.wait_for_timeout(3000)
-
-                # Scroll down to trigger lazy loading
-                page.evaluate("window.scrollTo(0, document.body.scrollHeight / 2)")
-                page.wait_for_timeout(1000)
-
-                html = page.content()
-
-                # Check for CAPTCHA
-                if self._detect_captcha(html):
-                    browser.close()
-                    return None, "CAPTCHA detected - site may be blocking automated access"
-
-                browser.close()
-                return html, None
-
+            return get_browser_pool().run(self._fetch_page, url, timeout)
         except Exception as e:
             return None, f"Error fetching with JavaScript: {str(e)}"
 
+    async def _fetch_page(self, browser, url: str, timeout: int) -> tuple[Optional[str], Optional[str]]:
+        """Load a page in a fresh browser context on the shared browser"""
+        # Create context with realistic browser fingerprint
+        context = await browser.new_context(
+            user_agent=random.choice(USER_AGENTS),
+            viewport={'width': 1920, 'height': 1080},
+            locale='en-US',
+            timezone_id='America/New_York',
+            geolocation={'latitude': 40.7128, 'longitude': -74.0060},
+            permissions=['geolocation'],
+            java_script_enabled=True,
+            bypass_csp=True,
+            extra_http_headers={
+                'Accept-Language': 'en-US,en;q=0.9',
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+            }
+        )
+
+        try:
+            page = await context.new_page()
+
+            # Add stealth scripts to avoid detection
+            await page.add_init_script(STEALTH_SCRIPT)
+
+            # Navigate with realistic behavior
+            try:
+                await page.goto(url, timeout=timeout, wait_until='domcontentloaded')
+            except Exception:
+                # Try with less strict wait condition
+                await page.goto(url, timeout=timeout, wait_until='commit')
+
+            # Wait for content to load
+            await page.wait_for_timeout(3000)
+
+            # Scroll down to trigger lazy loading
+            await page.evaluate("window.scrollTo(0, document.body.scrollHeight / 2)")
+            await page.wait_for_timeout(1000)
+
+            html = await page.content()
+        finally:
+            # Contexts are cheap, the browser stays up for the next fetch
+            await context.close()
+
+        # Check for CAPTCHA
+        if self._detect_captcha(html):
+            return None, "CAPTCHA detected - site may be blocking automated access"
+
+        return html, None
+
     def fetch(self, url: str, require_javascript: bool = False) -> tuple[Optional[str], Optional[str]]:
         """
         Smart fetch - tries static first, falls back to JS if needed.
@@ -177,18 +511,7 @@ class HtmlFetcherService:
 
         if html:
             # Check if the page seems to require JavaScript
-            soup = BeautifulSoup(html, 'lxml')
-
-            # Indicators that JS might be required
-            body_text = soup.get_text(strip=True)
-            js_required_indicators = [
-                'enable javascript',
-                'javascript is required',
-                'please enable javascript',
-                'loading...',
-            ]
-
-            if len(body_text) < 500 or any(ind in body_text.lower() for ind in js_required_indicators):
+            if self.needs_javascript(html):
                 logger.info(f"Static fetch may be incomplete, trying JavaScript for {url}")
                 js_html, js_error = self.fetch_with_javascript(url)
                 if js_html:
@@ -196,36 +519,106 @@ class HtmlFetcherService:
 
         return html, error
 
+    def needs_javascript(self, html: str, min_text: int = 500, sample: int = 1024) -> bool:
+        """
+        Guess whether a statically fetched page needs JavaScript to render:
+        less than `min_text` visible characters, or a JS-required notice in the first `sample` characters.
+        Stops scanning once `sample` characters have been read.
+        """
+        parts = []
+        length = 0
+        for text, text_length in _iter_visible_text(html):
+            parts.append(text)
+            length += text_length
+            if length >= sample:
+                break
+
+        if length < min_text:
+            return True
+        return _JS_REQUIRED_RE.search(' '.join(parts)) is not None
+
+    def visible_text_length(self, html: str, cap: Optional[int] = None) -> int:
+        """
+        Estimate the visible text length of a page without parsing it into a tree.
+        Stops scanning once `cap` characters have been counted.
+        """
+        length = 0
+        for _, text_length in _iter_visible_text(html):
+            length += text_length
+            if cap is not None and length >= cap:
+                break
+        return length
+
     def _detect_captcha(self, html: str) -> bool:
         """Detect common CAPTCHA patterns in HTML"""
-        captcha_indicators = [
-            'captcha',
-            'recaptcha',
-            'hcaptcha',
-            'challenge-form',
-            'bot-detection',
-            'verify you are human',
-            'are you a robot',
-            'prove you are not a robot',
-        ]
-        html_lower = html.lower()
-        return any(indicator in html_lower for indicator in captcha_indicators)
+        return _CAPTCHA_RE.search(html) is not None
 
     def extract_domain(self, url: str) -> str:
         """Extract domain from URL"""
-        parsed = urlparse(url)
-        return parsed.netloc
+        return _cached_urlparse(url).netloc
+
+    def skeletonize_html(self, cleaned_html: str) -> str:
+        """
+        Reduce cleaned HTML to its structure for selector generation: tags, class/id,
+        data-*/aria-* attributes and the first few characters of each text.
+        """
+        if not cleaned_html or not cleaned_html.strip():
+            return ''
+
+        # Comments are kept: clean_html_for_llm uses them to tell the model about sampled products
+        parser = lxml.html.HTMLParser(encoding='utf-8')
+        root = lxml.html.document_fromstring(cleaned_html.encode('utf-8', errors='replace'), parser=parser)
+
+        for element in root.iter():
+            element.tail = _shorten(element.tail, SKELETON_TEXT_CHARS)
+            if not isinstance(element.tag, str):
+                continue
+            element.text = _shorten(element.text, SKELETON_TEXT_CHARS)
+            attrib = element.attrib
+            for name, value in attrib.items():
+                if name in SKELETON_WHOLE_ATTRS:
+                    continue
+                if name in SKELETON_ATTRS or name.startswith(('data-', 'aria-')):
+                    if len(value) > SKELETON_VALUE_CHARS:
+                        attrib[name] = value[:SKELETON_VALUE_CHARS] + '...'
+                else:
+                    del attrib[name]
+
+        # Collapse long runs of look-alike siblings, noting how many were left out
+        for parent in [el for el in root.iter(tag=etree.Element) if len(el) > SKELETON_MAX_SIMILAR]:
+            seen = {}
+            removed = 0
+            for child in list(parent):
+                if not isinstance(child.tag, str):
+                    continue
+                key = (child.tag, child.get('class'))
+                seen[key] = seen.get(key, 0) + 1
+                if seen[key] > SKELETON_MAX_SIMILAR:
+                    parent.remove(child)
+                    removed += 1
+            if removed:
+                parent.append(etree.Comment(f' {removed} more similar items '))
+
+        # Serialize the body's content; the html/body wrapper added by the parser carries nothing
+        body = root.find('body')
+        if body is None:
+            body = root
+        # A comment ahead of the first element is parsed as a sibling of <html>
+        parts = [_to_html(comment) + '\n' for comment in reversed(list(root.itersiblings(preceding=True)))]
+        parts.append(body.text or '')
+        parts.extend(etree.tostring(child, encoding='unicode', method='html') for child in body)
+        return ''.join(parts)
 
     def normalize_url(self, url: str, base_url: str) -> str:
         """Normalize relative URLs to absolute"""
+        # Cheapest and most common case first: already absolute
+        if url.startswith(('http://', 'https://')):
+            return url
         if url.startswith('//'):
             return 'https:' + url
         if url.startswith('/'):
-            parsed = urlparse(base_url)
-            return f"{parsed.scheme}://{parsed.netloc}{url}"
-        if not url.startswith(('http://', 'https://')):
-            return base_url.rstrip('/') + '/' + url
-        return url
+            return _cached_origin(base_url) + url
+        return base_url.rstrip('/') + '/' + url
 
     def clean_html_for_llm(self, html: str, max_length: int = 80000) -> str:
         """
@@ -233,60 +626,44 @@ class HtmlFetcherService:
         Keeps structure and product-related content.
         Uses progressive cleaning - more aggressive only if needed.
         """
-        soup = BeautifulSoup(html, 'lxml')
+        if not html or not html.strip():
+            return ''
 
-        # === PASS 1: Basic cleaning ===
-        # Remove script and style elements
-        for element in soup(['script', 'style', 'noscript', 'iframe', 'svg']):
-            element.decompose()
+        root = parse_html(html)
 
-        # Remove head but keep body
-        head = soup.find('head')
-        if head:
-            head.decompose()
-
-        # Remove comments
-        from bs4 import Comment
-        for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
-            comment.extract()
+        # === PASS 1: Basic cleaning ===
+        # Remove script and style elements, and head but keep body
+        for element in _STRIP_ELEMENTS_XPATH(root):
+            _drop(element)
 
         # Remove hidden elements
-        for element in soup.find_all(attrs={'style': lambda x: x and 'display:none' in x.replace(' ', '')}):
-            element.decompose()
-        for element in soup.find_all(attrs={'hidden': True}):
-            element.decompose()
+        for element in _STYLED_XPATH(root):
+            if 'display:none' in element.get('style', '').replace(' ', ''):
+                _drop(element)
+        for element in _HIDDEN_XPATH(root):
+            _drop(element)
 
         # Remove common non-product sections to save space
-        # Be careful not to match body or main content containers
-        for selector in ['header', 'footer', 'nav',
-                         'div[class*="cookie"]', 'div[class*="newsletter"]',
-                         'div[class*="popup"]', 'div[class*="modal"]',
-                         'aside[class*="banner"]', 'div[id*="cookie"]',
-                         '.didomi-popup-container', '.didomi-popup-backdrop']:
-            for element in soup.select(selector):
+        for selector in _NOISE_CSS:
+            for element in selector(root):
                 # Don't remove if it contains product elements
-                if element.select('[class*="product"], [data-sku], [data-product]'):
+                if any(child is not element for child in _NOISE_KEEP_CSS(element)):
                     continue
-                element.decompose()
+                _drop(element)
 
         # Try to find and prioritize product listing area
-        product_area = None
-        for selector in ['[class*="plp"]', '[class*="product-list"]', '[class*="product-grid"]',
-                         '[class*="listing"]', 'main', '[role="main"]', '[class*="results"]']:
-            product_area = soup.select_one(selector)
-            if product_area:
-                break
+        product_area = _find_product_area(root)
 
         # If we found a product area and it has product-like elements, use just that
-        if product_area:
-            product_elements = product_area.select('[data-sku], [data-product], [class*="product"], [class*="card"]')
+        if product_area is not None:
+            product_elements = [el for el in _PRODUCT_AREA_ITEM_CSS(product_area) if el is not product_area]
             if len(product_elements) > 3:
-                cleaned = str(product_area)
+                cleaned = _to_html(product_area)
                 if len(cleaned) <= max_length:
                     return cleaned
 
         # Get result of pass 1
-        cleaned = str(soup)
+        cleaned = _to_html(root)
 
         # If small enough, return
         if len(cleaned) <= max_length:
@@ -295,23 +672,19 @@ class HtmlFetcherService:
         # === PASS 2: Aggressive cleaning (only if still too large) ===
         logger.info(f"HTML still too large ({len(cleaned):,} chars), applying aggressive cleaning...")
 
-        # Find all product-like containers (including modern React/Next.js patterns)
-        product_containers = soup.select(
-            '[data-sku], [data-product-id], [data-pid], [data-item-id], '
-            '[class*="product-card"], [class*="product-tile"], [class*="product-item"], '
-            '[class*="productCard"], [class*="ProductCard"], [class*="ProductGrid_grid_item"], '
-            '[class*="_product_card"], [class*="product_card"], [class*="grid_item_wrapper"], '
-            '[class*="ProductTile"], [class*="product-listing"], [class*="plp-product"]'
-        )
+        # Find all product-like containers
+        product_containers = _PRODUCT_CONTAINER_CSS(root)
 
         if product_containers:
             # Take a sample of products (first 15) to keep size manageable
             sample_size = min(15, len(product_containers))
-            sample_html = f"<!-- Found {len(product_containers)} products, showing {sample_size} samples -->\n"
-            sample_html += "<div class='product-samples'>\n"
-            for container in product_containers[:sample_size]:
-                sample_html += str(container) + "\n"
-            sample_html += "</div>"
+            parts = [
+                f"<!-- Found {len(product_containers)} products, showing {sample_size} samples -->",
+                "<div class='product-samples'>",
+            ]
+            parts.extend(_to_html(container) for container in product_containers[:sample_size])
+            parts.append("</div>")
+            sample_html = "\n".join(parts)
 
             if len(sample_html) <= max_length:
                 logger.info(f"Using {sample_size} product samples ({len(sample_html):,} chars)")
@@ -321,15 +694,16 @@ class HtmlFetcherService:
         if len(cleaned) > max_length:
             logger.info("Stripping non-essential attributes...")
             # Remove most attributes except essential ones
-            for tag in soup.find_all(True):
-                attrs_to_keep = {}
-                for attr in ['class', 'id', 'href', 'src', 'data-src', 'alt', 'title',
-                             'data-sku', 'data-product', 'data-price', 'aria-label']:
-                    if attr in tag.attrs:
-                        attrs_to_keep[attr] = tag.attrs[attr]
-                tag.attrs = attrs_to_keep
-
-            cleaned = str(soup)
+            stripped = False
+            for element in root.iter(tag=etree.Element):
+                for attr in element.attrib.keys():
+                    if attr not in ESSENTIAL_ATTRS:
+                        del element.attrib[attr]
+                        stripped = True
+
+            # Pass 1's serialization is still current if nothing was removed
+            if stripped:
+                cleaned = _to_html(root)
 
         # Final truncation if still too long
         if len(cleaned) > max_length:
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.models import LlmCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Longest ttl any caller reads with; older rows can never be served and are pruned
+MAX_TTL = 24 * 3600
+
+
+def make_key(prefix: str, **parts) -> str:
+    """Build a deterministic cache key from request parts"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return f"{prefix}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+def get(key: str, ttl: int) -> Optional[str]:
+    """Return the cached response for key if it is younger than ttl seconds"""
+    entry = db.session.get(LlmCacheEntry, key)
+    if entry and entry.created_at >= datetime.utcnow() - timedelta(seconds=ttl):
+        return entry.response
+    return None
+
+
+def set(key: str, response: str):
+    """
+    Store a response under key, replacing any previous entry.
+    Written in a savepoint of the caller's transaction, which the caller commits; the upsert
+    lets parallel workers write the same key. A failed write is logged, not raised.
+    """
+    now = datetime.utcnow()
+    statement = pg_insert(LlmCacheEntry).values(key=key, response=response, created_at=now)
+    statement = statement.on_conflict_do_update(
+        index_elements=[LlmCacheEntry.key],
+        set_={'response': statement.excluded.response, 'created_at': statement.excluded.created_at},
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.execute(statement)
+    except SQLAlchemyError:
+        logger.warning(f"LLM cache write failed for {key}", exc_info=True)
+
+
+def delete(key: str):
+    """Remove the entry for key, if any; like set(), in a savepoint the caller commits"""
+    try:
+        with db.session.begin_nested():
+            db.session.execute(db.delete(LlmCacheEntry).where(LlmCacheEntry.key == key))
+    except SQLAlchemyError:
+        logger.warning(f"LLM cache delete failed for {key}", exc_info=True)
+
+
+def prune(max_age: int = MAX_TTL) -> int:
+    """Delete entries older than max_age seconds; returns the number removed"""
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    result = db.session.execute(db.delete(LlmCacheEntry).where(LlmCacheEntry.created_at < cutoff))
+    db.session.commit()
+    return result.rowcount
+
+
+def get_or_set(key: str, fetch_fn: Callable[[], str], ttl: int) -> str:
+    """Return the cached response for key, calling fetch_fn and storing its result on a miss"""
+    cached = get(key, ttl)
+    if cached is not None:
+        logger.debug(f"LLM cache hit for {key}")
+        return cached
+
+    response = fetch_fn()
+    set(key, response)
+    return response
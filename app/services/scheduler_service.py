@@ -1,12 +1,15 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from decimal import Decimal
 
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
 from app import db
 from app.models import Source, Product, PriceHistory, SyncLog, UserSettings
+from app.services import llm_cache
 from app.services.scraper_service import ScraperService
 
 logger = logging.getLogger(__name__)
@@ -14,6 +17,12 @@ logger = logging.getLogger(__name__)
 # Global scheduler instance
 scheduler = None
 
+# How long a claimed source is hidden from other schedulers while its sync runs
+SYNC_CLAIM_LEASE = timedelta(hours=1)
+
+# Manual sync jobs are named <prefix><source_id>_<sync_log_id>
+MANUAL_SYNC_JOB_PREFIX = 'sync_source_'
+
 
 def get_scheduler():
     """Get or create the scheduler instance"""
@@ -37,6 +46,18 @@ def init_scheduler(app):
         replace_existing=True
     )
 
+    # Drop LLM cache entries too old to be served - runs hourly
+    scheduler.add_job(
+        func=lambda: prune_llm_cache(app),
+        trigger=IntervalTrigger(hours=1),
+        id='llm_cache_prune',
+        name='Prune expired LLM cache entries',
+        replace_existing=True
+    )
+
+    # A manual sync job that never runs would leave its SyncLog 'running' (and the page polling) forever
+    scheduler.add_listener(lambda event: fail_dropped_sync_job(app, event), EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+
     if not scheduler.running:
         scheduler.start()
         logger.info("Scheduler started")
@@ -50,47 +71,185 @@ def shutdown_scheduler():
         logger.info("Scheduler stopped")
 
 
+def fail_dropped_sync_job(app, event):
+    """Mark the SyncLog of a manual sync job the scheduler skipped as failed"""
+    if not event.job_id.startswith(MANUAL_SYNC_JOB_PREFIX):
+        return
+    sync_log_id = int(event.job_id.rsplit('_', 1)[1])
+    with app.app_context():
+        db.session.execute(
+            db.update(SyncLog)
+            .where(SyncLog.id == sync_log_id, SyncLog.status == 'running')
+            .values(status='failed', completed_at=datetime.utcnow(), error_message='Sync job was skipped by the scheduler')
+        )
+        db.session.commit()
+
+
+def active_sync_log_filter(now: datetime):
+    """SyncLog criteria for a sync that is still in progress (older 'running' logs are from a dead process)"""
+    return db.and_(SyncLog.status == 'running', SyncLog.started_at >= now - SYNC_CLAIM_LEASE)
+
+
+def prune_llm_cache(app):
+    """Delete expired LLM cache entries"""
+    with app.app_context():
+        removed = llm_cache.prune()
+        if removed:
+            logger.info(f"Pruned {removed} expired LLM cache entries")
+
+
 def check_and_sync_sources(app):
-    """Check for sources that need syncing and sync them"""
+    """Check for sources that need syncing and sync them concurrently"""
     with app.app_context():
         now = datetime.utcnow()
 
-        # Find sources that need syncing
-        sources = Source.query.filter(
+        # Claim sources that need syncing: due rows are locked with SKIP LOCKED and their next_sync_at
+        # pushed out by a lease, so schedulers in other processes/hosts skip them. sync_source sets the
+        # real next sync time when it finishes; if this process dies, the source is retried after the lease.
+        # Sources with a manual sync in progress are skipped.
+        due_sources = db.select(Source.id).where(
             Source.status == 'active',
             db.or_(
                 Source.next_sync_at <= now,
                 Source.next_sync_at.is_(None)
-            )
+            ),
+            ~db.exists().where(SyncLog.source_id == Source.id, active_sync_log_filter(now))
+        ).with_for_update(skip_locked=True)
+        claimed = db.session.execute(
+            db.update(Source)
+            .where(Source.id.in_(due_sources))
+            .values(next_sync_at=now + SYNC_CLAIM_LEASE)
+            .returning(Source.id, Source.user_id)
+            .execution_options(synchronize_session=False)
         ).all()
 
-        for source in sources:
+        # Sync logs are created with the claim, so a manual sync requested meanwhile sees them as running
+        sync_log_ids = {}
+        if claimed:
+            sync_log_ids = dict(db.session.execute(
+                db.insert(SyncLog).returning(SyncLog.source_id, SyncLog.id),
+                [{'source_id': source_id} for source_id, _ in claimed]
+            ).all())
+        db.session.commit()
+
+        if not claimed:
+            return
+
+        # Many sources share an owner: look up and decrypt each user's key once per tick
+        credentials_by_user = {}
+        for user_settings in UserSettings.query.filter(
+            UserSettings.user_id.in_({user_id for _, user_id in claimed})
+        ):
             try:
-                sync_source(source)
+                credentials_by_user[user_settings.user_id] = get_sync_credentials(user_settings)
             except Exception as e:
-                logger.exception(f"Error syncing source {source.id}: {e}")
+                # Left out; sync_source looks the key up itself and records the failure on the source
+                logger.warning(f"Could not load API key for user {user_settings.user_id}: {e}")
+        max_workers = app.config.get('SYNC_MAX_WORKERS', 8)
+
+    # Syncs are dominated by network I/O (page fetches, LLM calls), so run them in parallel.
+    # Each worker pushes its own app context and therefore gets its own session.
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sync') as executor:
+        futures = {
+            executor.submit(
+                sync_source_by_id, app, source_id, sync_log_ids[source_id], credentials_by_user.get(user_id)
+            ): source_id
+            for source_id, user_id in claimed
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.exception(f"Error syncing source {futures[future]}: {e}")
+
+
+def queue_source_sync(app, source: Source) -> SyncLog | None:
+    """
+    Run a sync for a source on the background scheduler.
+    Returns the pending SyncLog (the in-progress one if the source is already syncing),
+    or None if the scheduler isn't running.
+    """
+    scheduler = get_scheduler()
+    if not scheduler.running:
+        return None
+
+    now = datetime.utcnow()
+
+    # Lock the source row: concurrent requests and the scheduler's claim serialize here
+    db.session.execute(db.select(Source.id).where(Source.id == source.id).with_for_update())
+    running = SyncLog.query.filter(
+        SyncLog.source_id == source.id, active_sync_log_filter(now)
+    ).order_by(SyncLog.started_at.desc()).first()
+    if running:
+        db.session.commit()
+        return running
+
+    # Take the same lease as a scheduled claim so the sync check doesn't start this source too
+    db.session.execute(
+        db.update(Source)
+        .where(Source.id == source.id)
+        .values(next_sync_at=now + SYNC_CLAIM_LEASE)
+        .execution_options(synchronize_session=False)
+    )
+    sync_log = SyncLog(source_id=source.id)
+    db.session.add(sync_log)
+    db.session.commit()
+
+    try:
+        scheduler.add_job(
+            func=sync_source_by_id,
+            args=[app, source.id, sync_log.id],
+            id=f'{MANUAL_SYNC_JOB_PREFIX}{source.id}_{sync_log.id}',
+            name=f'Manual sync for source {source.id}',
+            misfire_grace_time=None
+        )
+    except Exception as e:
+        logger.exception(f"Could not queue sync for source {source.id}")
+        sync_log.status = 'failed'
+        sync_log.completed_at = datetime.utcnow()
+        sync_log.error_message = f"Could not queue sync: {e}"
+        db.session.commit()
+    return sync_log
+
+
+def sync_source_by_id(app, source_id: int, sync_log_id: int = None, credentials: tuple[str, str] = None):
+    """Sync a source by ID inside its own app context (for background jobs)"""
+    with app.app_context():
+        source = db.session.get(Source, source_id)
+        if not source:
+            return
+        sync_log = db.session.get(SyncLog, sync_log_id) if sync_log_id else None
+        sync_source(source, sync_log, credentials)
+
+
+def get_sync_credentials(user_settings: UserSettings | None) -> tuple[str, str]:
+    """Return (api_key, model) for syncing a user's sources"""
+    api_key = user_settings.get_api_key() if user_settings else None
+    if not api_key:
+        raise ValueError("No API key configured for user")
+    return api_key, user_settings.selected_model or 'claude-3-5-haiku-latest'
 
 
-def sync_source(source: Source) -> SyncLog:
+def sync_source(source: Source, sync_log: SyncLog = None, credentials: tuple[str, str] = None) -> SyncLog:
     """
     Sync a single source - fetch products and update database.
+    `credentials` is an (api_key, model) pair if the caller already loaded it.
     Returns the SyncLog record.
     """
     print(f"[SYNC] Starting sync for source '{source.name}' (ID: {source.id})")
 
     # Create sync log
-    sync_log = SyncLog(source_id=source.id)
-    db.session.add(sync_log)
-    db.session.commit()
+    if sync_log is None:
+        sync_log = SyncLog(source_id=source.id)
+        db.session.add(sync_log)
+        db.session.commit()
 
     try:
         # Get user's API key
-        user_settings = UserSettings.query.filter_by(user_id=source.user_id).first()
-        if not user_settings or not user_settings.get_api_key():
-            raise ValueError("No API key configured for user")
-
-        api_key = user_settings.get_api_key()
-        model = user_settings.selected_model or 'claude-3-5-haiku-latest'
+        if credentials is None:
+            user_settings = UserSettings.query.filter_by(user_id=source.user_id).first()
+            credentials = get_sync_credentials(user_settings)
+        api_key, model = credentials
         print(f"[SYNC] Using model: {model}")
 
         # Create scraper service
@@ -123,7 +282,8 @@ def sync_source(source: Source) -> SyncLog:
 
         # Update selectors if regenerated
         if selectors_regenerated:
-            new_selectors, _ = scraper.analyze_url(source.base_url)
+            # extract_products already generated and verified them; don't analyze the page again
+            new_selectors = scraper.regenerated_selectors
             if new_selectors:
                 source.selectors = new_selectors
                 source.selector_version += 1
@@ -132,21 +292,34 @@ def sync_source(source: Source) -> SyncLog:
         # Process extracted products
         products_added = 0
         products_updated = 0
-
+        price_history_rows = []
+        product_updates = []
+
+        # Load all already-known products for the extracted URLs in one query
+        product_urls = {p['product_url'] for p in products_data if p.get('product_url')}
+        existing_by_url = {}
+        if product_urls:
+            existing_by_url = {
+                product.product_url: product
+                for product in Product.query.filter(
+                    Product.source_id == source.id,
+                    Product.product_url.in_(product_urls)
+                )
+            }
+
+        seen_urls = set()
         for product_data in products_data:
             product_url = product_data.get('product_url')
-            if not product_url:
+            # A product listed twice on the page (e.g. in a carousel and the grid) is processed once
+            if not product_url or product_url in seen_urls:
                 continue
+            seen_urls.add(product_url)
 
-            # Find existing product by URL
-            existing = Product.query.filter_by(
-                source_id=source.id,
-                product_url=product_url
-            ).first()
+            existing = existing_by_url.get(product_url)
 
             if existing:
                 # Update existing product
-                updated = update_product(existing, product_data)
+                updated = update_product(existing, product_data, price_history_rows, product_updates)
                 if updated:
                     products_updated += 1
             else:
@@ -154,6 +327,13 @@ def sync_source(source: Source) -> SyncLog:
                 create_product(source.id, product_data)
                 products_added += 1
 
+        # Apply all product updates as one executemany UPDATE by primary key,
+        # and record all price changes with one multi-row INSERT
+        if product_updates:
+            db.session.execute(db.update(Product), product_updates)
+        if price_history_rows:
+            db.session.execute(db.insert(PriceHistory), price_history_rows)
+
         # Update sync log
         sync_log.status = 'success'
         sync_log.completed_at = datetime.utcnow()
@@ -214,12 +394,12 @@ def create_product(source_id: int, data: dict) -> Product:
         is_available=True
     )
     db.session.add(product)
-    db.session.flush()  # Get the product ID
 
-    # Add initial price history
+    # Add initial price history (linked through the relationship, so no flush is needed for the ID;
+    # new products and their history are inserted in batches at commit)
     if product.current_price:
         history = PriceHistory(
-            product_id=product.id,
+            product=product,
             price=product.current_price
         )
         db.session.add(history)
@@ -227,34 +407,45 @@ def create_product(source_id: int, data: dict) -> Product:
     return product
 
 
-def update_product(product: Product, data: dict) -> bool:
-    """Update an existing product with new data. Returns True if price changed."""
+def update_product(product: Product, data: dict, price_history_rows: list = None,
+                   product_updates: list = None) -> bool:
+    """
+    Update an existing product with new data. Returns True if price changed.
+    If price_history_rows / product_updates are given, the new price record and the column changes
+    are appended to them for bulk statements instead of going through the session.
+    """
     price_changed = False
     new_price = data.get('price')
+    changes = {}
 
     # Check if price changed
     if new_price and product.current_price != new_price:
         # Add to price history
-        history = PriceHistory(
-            product_id=product.id,
-            price=new_price
-        )
-        db.session.add(history)
-        product.current_price = new_price
+        if price_history_rows is not None:
+            price_history_rows.append({'product_id': product.id, 'price': new_price})
+        else:
+            db.session.add(PriceHistory(product_id=product.id, price=new_price))
+        changes['current_price'] = new_price
         price_changed = True
 
     # Update other fields
     if data.get('name'):
-        product.name = data['name'][:500]
+        changes['name'] = data['name'][:500]
     if data.get('image_url'):
-        product.image_url = data['image_url']
+        changes['image_url'] = data['image_url']
     if data.get('original_price'):
-        product.original_price = data['original_price']
+        changes['original_price'] = data['original_price']
     if data.get('description'):
-        product.description = data['description']
+        changes['description'] = data['description']
+
+    changes['is_available'] = True
+    changes['last_updated_at'] = datetime.utcnow()
 
-    product.is_available = True
-    product.last_updated_at = datetime.utcnow()
+    if product_updates is not None:
+        product_updates.append({'id': product.id, **changes})
+    else:
+        for key, value in changes.items():
+            setattr(product, key, value)
 
     return price_changed
 
@@ -271,23 +462,34 @@ def mark_unavailable_products(source_id: int, found_urls: set):
         product.is_available = False
 
 
-def get_sync_stats(source_id: int) -> dict:
-    """Get sync statistics for a source"""
-    logs = SyncLog.query.filter_by(source_id=source_id).order_by(SyncLog.started_at.desc()).limit(10).all()
+def get_sync_stats(source_id: int, include_logs: bool = True) -> dict:
+    """Get sync statistics for a source's last 10 syncs"""
+    recent = db.select(SyncLog.status, SyncLog.products_found).where(
+        SyncLog.source_id == source_id
+    ).order_by(SyncLog.started_at.desc()).limit(10).subquery()
 
-    if not logs:
+    total, successes, avg_products = db.session.execute(
+        db.select(
+            db.func.count(),
+            db.func.count().filter(recent.c.status == 'success'),
+            db.func.avg(db.func.coalesce(recent.c.products_found, 0))
+        ).select_from(recent)
+    ).one()
+
+    if not total:
         return {
             'total_syncs': 0,
             'success_rate': 0,
             'avg_products_found': 0
         }
 
-    success_count = sum(1 for log in logs if log.status == 'success')
-    avg_products = sum(log.products_found or 0 for log in logs) / len(logs)
-
-    return {
-        'total_syncs': len(logs),
-        'success_rate': (success_count / len(logs)) * 100,
-        'avg_products_found': round(avg_products, 1),
-        'recent_logs': logs
+    stats = {
+        'total_syncs': total,
+        'success_rate': (successes / total) * 100,
+        'avg_products_found': round(float(avg_products), 1)
     }
+    if include_logs:
+        stats['recent_logs'] = SyncLog.query.filter_by(source_id=source_id).order_by(
+            SyncLog.started_at.desc()
+        ).limit(10).all()
+    return stats
@@ -3,36 +3,95 @@ import re
 import logging
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
-from typing import Optional
+from functools import lru_cache
+from typing import Generator, Optional
 from urllib.parse import urljoin
 
 import anthropic
-from bs4 import BeautifulSoup
+import httpx
+import orjson
+from cssselect import SelectorError
+from lxml import etree
+from lxml.cssselect import LxmlHTMLTranslator
 
-from app.services.html_fetcher_service import HtmlFetcherService
+from app.services import llm_cache
+from app.services.anthropic_service import get_http_client
+from app.services.html_fetcher_service import HtmlFetcherService, parse_html
 
 logger = logging.getLogger(__name__)
 
+# Tools the model is made to call, so answers arrive as structured tool input instead of JSON inside prose
+_NULLABLE_STRING = {'type': ['string', 'null']}
+SELECTOR_TOOL = {
+    'name': 'return_selectors',
+    'description': 'Return the CSS selectors for extracting products from the page.',
+    'input_schema': {
+        'type': 'object',
+        'properties': {
+            'product_container': _NULLABLE_STRING,
+            'name': _NULLABLE_STRING,
+            'price': _NULLABLE_STRING,
+            'original_price': _NULLABLE_STRING,
+            'image': _NULLABLE_STRING,
+            'link': _NULLABLE_STRING,
+            'description': _NULLABLE_STRING,
+            'requires_javascript': {'type': 'boolean'},
+            'notes': {'type': 'string'},
+        },
+        'required': ['product_container', 'name', 'price', 'image', 'link', 'requires_javascript'],
+    },
+}
+PRODUCTS_TOOL = {
+    'name': 'return_products',
+    'description': 'Return every product found on the page.',
+    'input_schema': {
+        'type': 'object',
+        'properties': {
+            'products': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'name': {'type': 'string'},
+                        'price': {'type': ['number', 'null']},
+                        'original_price': {'type': ['number', 'null']},
+                        'image_url': _NULLABLE_STRING,
+                        'product_url': _NULLABLE_STRING,
+                        'description': _NULLABLE_STRING,
+                    },
+                    'required': ['name', 'price', 'product_url'],
+                },
+            },
+        },
+        'required': ['products'],
+    },
+}
+
+# Identical prompts (same model, URL and cleaned HTML) reuse the stored LLM response for this long
+SELECTOR_CACHE_TTL = llm_cache.MAX_TTL
+EXTRACTION_CACHE_TTL = 3600
+
+# Cleaned HTML budget for direct LLM extraction (selector generation uses the cleaner's default)
+DIRECT_EXTRACTION_MAX_HTML = 40000
+
 # Prompt for generating CSS selectors
 SELECTOR_GENERATION_PROMPT = """Analyze this HTML from a shopping website and extract CSS selectors for product listings.
 
 The page URL is: {url}
 
-I need you to identify CSS selectors that can extract product information from this page.
+Identify CSS selectors that can extract product information from this page.
 Look for product cards, listings, or grid items that contain products.
 
-Return ONLY a valid JSON object with this exact structure (no markdown, no explanation):
-{{
-    "product_container": "CSS selector for individual product cards/items",
-    "name": "CSS selector for product name (relative to container)",
-    "price": "CSS selector for current price (relative to container)",
-    "original_price": "CSS selector for original/crossed-out price if exists (relative to container), or null",
-    "image": "CSS selector for product image (relative to container)",
-    "link": "CSS selector for product link (relative to container)",
-    "description": "CSS selector for short description if exists (relative to container), or null",
-    "requires_javascript": false,
-    "notes": "Any notes about the page structure"
-}}
+Call the return_selectors tool with these fields:
+- product_container: CSS selector for individual product cards/items
+- name: CSS selector for the product name (relative to container)
+- price: CSS selector for the current price (relative to container)
+- original_price: CSS selector for the original/crossed-out price (relative to container), or null
+- image: CSS selector for the product image (relative to container)
+- link: CSS selector for the product link (relative to container)
+- description: CSS selector for a short description (relative to container), or null
+- requires_javascript: whether the page needs JavaScript to render its products
+- notes: any notes about the page structure
 
 Important rules:
 1. The product_container should match multiple product items on the page
@@ -58,7 +117,8 @@ DIRECT_EXTRACTION_PROMPT = """Analyze this HTML from a shopping website and extr
 
 The page URL is: {url}
 
-Extract all products visible on this page. For each product, extract:
+Extract all products visible on this page and call the return_products tool with them.
+For each product, fill in:
 - name: Product title/name
 - price: Current selling price (number only, no currency symbol). Convert from local format (e.g., €590 -> 590)
 - original_price: Original price if on sale (number only), or null
@@ -73,108 +133,285 @@ Tips for finding products:
 - Prices may be in elements with classes containing "price", "cost", "sale"
 - Product names are often in h2, h3, or elements with "title" in the class
 
-Return ONLY a valid JSON array with this structure (no markdown, no explanation):
-[
-    {{
-        "name": "Product Name",
-        "price": 29.99,
-        "original_price": 49.99,
-        "image_url": "https://...",
-        "product_url": "https://...",
-        "description": "Short description"
-    }}
-]
-
-If no products found, return an empty array: []
+If no products are found, call return_products with an empty products list.
 
 HTML content:
 {html}"""
 
 
+@lru_cache(maxsize=256)
+def _compile_selector(selector: str, limit: Optional[int] = None) -> Optional[etree.XPath]:
+    """
+    Compile a CSS selector to XPath once; selectors are reused for every container and every sync of a source.
+    Matches descendants only, never the element it is applied to (selectors are relative to the container).
+    With limit, only the first limit matches (in document order) are returned to Python.
+    Returns None for selectors cssselect can't translate (e.g. *:first-of-type), so they match nothing.
+    """
+    try:
+        xpath = LxmlHTMLTranslator().css_to_xpath(selector, prefix='descendant::')
+        if limit:
+            xpath = f'({xpath})[position() <= {limit}]'
+        return etree.XPath(xpath)
+    except (SelectorError, etree.XPathError) as e:
+        logger.warning("Unsupported CSS selector %r: %s", selector, e)
+        return None
+
+
+def _select_all(selector: str, element, limit: Optional[int] = None) -> list:
+    """Descendants of element matching selector; an unsupported selector matches nothing"""
+    compiled = _compile_selector(selector, limit)
+    if compiled is None:
+        return []
+    try:
+        return compiled(element)
+    except etree.XPathError as e:
+        logger.warning("CSS selector %r failed to evaluate: %s", selector, e)
+        return []
+
+
+def _select_one(selector: str, element):
+    """First descendant of element matching selector, or None"""
+    matches = _select_all(selector, element, 1)
+    return matches[0] if matches else None
+
+
+# Everything that is not a digit or a separator (currency symbols, whitespace, labels)
+_PRICE_NOISE_RE = re.compile(r'[^\d.,]+')
+
+
+@lru_cache(maxsize=4096)
+def _parse_price_text(text: str) -> Optional[Decimal]:
+    """Parse a price string; cached since catalog pages repeat the same few price labels"""
+    cleaned = _PRICE_NOISE_RE.sub('', text)
+
+    # Handle different decimal formats
+    comma = cleaned.rfind(',')
+    if comma != -1:
+        dot = cleaned.rfind('.')
+        if dot != -1:
+            if comma > dot:
+                # European format: 1.234,56
+                cleaned = cleaned.replace('.', '').replace(',', '.')
+            else:
+                # US format: 1,234.56
+                cleaned = cleaned.replace(',', '')
+        elif cleaned.count(',') == 1 and len(cleaned) - comma == 3:
+            # Likely decimal: 12,99
+            cleaned = cleaned.replace(',', '.')
+        else:
+            # Likely thousands: 1,234
+            cleaned = cleaned.replace(',', '')
+
+    try:
+        return Decimal(cleaned)
+    except (InvalidOperation, ValueError):
+        return None
+
+
+_JSON_DECODER = json.JSONDecoder()
+_ARRAY_GAP_RE = re.compile(r'[\s,]*')
+
+# JSON object / array wrapped in a markdown code block
+_JSON_BLOCK_OBJ_RE = re.compile(r'```(?:json)?\s*(\{[\s\S]*?\})\s*```')
+_JSON_BLOCK_ARR_RE = re.compile(r'```(?:json)?\s*(\[[\s\S]*?\])\s*```')
+
+
+def _tool_input(response, tool_name: str) -> Optional[dict]:
+    """Input of the named tool_use block in a response, or None if the model answered in text"""
+    for block in response.content:
+        if block.type == 'tool_use' and block.name == tool_name:
+            return block.input
+    return None
+
+
+def _find_json(text: str, open_char: str, accept=None):
+    """
+    First complete JSON object ('{') or array ('[') embedded in text, or None.
+    Each candidate is decoded exactly up to its matching close bracket, so trailing text
+    or a second JSON value doesn't spoil the match; on a parse error (or if accept rejects
+    the value) the next candidate is tried.
+    """
+    start = text.find(open_char)
+    while start != -1:
+        try:
+            value = _JSON_DECODER.raw_decode(text, start)[0]
+            if accept is None or accept(value):
+                return value
+        except json.JSONDecodeError:
+            pass
+        start = text.find(open_char, start + 1)
+    return None
+
+
+class _StreamedJsonArray:
+    """Decodes the objects of a JSON array as it streams in, returning each one once it is complete"""
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = -1  # Next unread index inside the array; -1 until the opening bracket arrives
+        self.done = False
+
+    def feed(self, text: str) -> list[dict]:
+        self.buffer += text
+        items = []
+        if self.done:
+            return items
+        if self.pos < 0:
+            start = self.buffer.find('[')
+            if start < 0:
+                return items
+            self.pos = start + 1
+
+        while True:
+            self.pos = _ARRAY_GAP_RE.match(self.buffer, self.pos).end()
+            if self.pos >= len(self.buffer):
+                break
+            if self.buffer[self.pos] == ']':
+                self.done = True
+                break
+            if self.buffer[self.pos] != '{':
+                # Not an array of objects; leave it to the full parse at the end
+                break
+            try:
+                item, self.pos = _JSON_DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Object not complete yet
+                break
+            items.append(item)
+        return items
+
+
+# Text nodes under an element, excluding script/style bodies; plain strings, as only their content is joined
+_TEXT_NODES_XPATH = etree.XPath('.//text()[not(parent::script or parent::style)]', smart_strings=False)
+
+
+def _get_text(element, strip: bool = False) -> str:
+    """Concatenated text of an element; with strip=True each text node is stripped first"""
+    if strip:
+        return ''.join(text.strip() for text in _TEXT_NODES_XPATH(element))
+    return ''.join(_TEXT_NODES_XPATH(element))
+
+
 class ScraperService:
     """Service for scraping products from shopping websites using LLM-generated selectors"""
 
-    def __init__(self, api_key: str, model: str = 'claude-3-5-haiku-latest'):
-        self.client = anthropic.Anthropic(api_key=api_key)
+    def __init__(self, api_key: str, model: str = 'claude-3-5-haiku-latest', http_client: httpx.Client = None):
+        # Shares the Anthropic connection pool by default, so repeat calls skip the TCP/TLS handshake
+        self.client = anthropic.Anthropic(api_key=api_key, http_client=http_client or get_http_client())
         self.model = model
         self.fetcher = HtmlFetcherService()
         self.tokens_used = 0
+        # Selectors generated by the last extract_products call that had to regenerate them
+        self.regenerated_selectors = None
+        # (cache_key, response_text, from_cache) of the last generated selectors, until they are validated
+        self._pending_selectors = None
 
-    def analyze_url(self, url: str) -> tuple[Optional[dict], Optional[str]]:
+    def analyze_url(self, url: str, html: str = None, cleaned_html: str = None) -> tuple[Optional[dict], Optional[str]]:
         """
         Analyze a URL and generate CSS selectors for product extraction.
+        Pass html (and its cleaned_html) to analyze an already fetched page instead of fetching it again.
         Returns (selectors_dict, error_message)
         """
         # Fetch the page
-        html, error = self.fetcher.fetch(url)
-        if error:
-            return None, error
+        if not html:
+            html, error = self.fetcher.fetch(url)
+            if error:
+                return None, error
+            cleaned_html = None
 
         # Clean HTML for LLM
-        cleaned_html = self.fetcher.clean_html_for_llm(html)
+        if cleaned_html is None:
+            cleaned_html = self.fetcher.clean_html_for_llm(html)
 
         # Generate selectors using LLM
-        try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=2000,
-                messages=[{
-                    'role': 'user',
-                    'content': SELECTOR_GENERATION_PROMPT.format(url=url, html=cleaned_html)
-                }]
-            )
-
-            self.tokens_used += response.usage.input_tokens + response.usage.output_tokens
-
-            # Parse the JSON response
-            response_text = response.content[0].text.strip()
+        selectors, error = self.analyze_url_with_html(url, cleaned_html)
+        if error or selectors.get('use_llm_extraction'):
+            return selectors, error
 
-            # Try to extract JSON from response
-            selectors = self._parse_json_response(response_text)
-
-            if selectors:
-                # Validate the selectors work
-                test_products = self._extract_with_selectors(html, selectors, url)
-                if test_products:
-                    selectors['_sample_count'] = len(test_products)
-                    return selectors, None
-                else:
-                    # Selectors didn't work, try direct extraction
-                    logger.warning("Generated selectors didn't extract any products, falling back to direct extraction")
+        try:
+            # Validate the selectors work
+            test_products = self._extract_with_selectors(html, selectors, url)
+            if test_products:
+                self.confirm_selectors()
+                selectors['_sample_count'] = len(test_products)
+                return selectors, None
+            else:
+                # Selectors didn't work, try direct extraction
+                self.reject_selectors()
+                logger.warning("Generated selectors didn't extract any products, falling back to direct extraction")
 
             # Fallback: Direct LLM extraction
             return self._generate_selectors_from_direct_extraction(html, url)
 
-        except anthropic.APIError as e:
-            return None, f"API error: {str(e)}"
         except Exception as e:
             logger.exception("Error analyzing URL")
             return None, f"Error analyzing page: {str(e)}"
 
-    def analyze_url_with_html(self, url: str, cleaned_html: str) -> tuple[Optional[dict], Optional[str]]:
+    def analyze_url_with_html(self, url: str, cleaned_html: str, use_cache: bool = True) -> tuple[Optional[dict], Optional[str]]:
         """
         Analyze pre-cleaned HTML and generate CSS selectors for product extraction.
         Returns (selectors_dict, error_message)
         """
-        try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=2000,
-                messages=[{
-                    'role': 'user',
-                    'content': SELECTOR_GENERATION_PROMPT.format(url=url, html=cleaned_html)
-                }]
-            )
-
-            self.tokens_used += response.usage.input_tokens + response.usage.output_tokens
+        stream = self.analyze_url_with_html_stream(url, cleaned_html, use_cache=use_cache)
+        while True:
+            try:
+                next(stream)
+            except StopIteration as stop:
+                return stop.value
 
-            # Parse the JSON response
-            response_text = response.content[0].text.strip()
+    def analyze_url_with_html_stream(self, url: str, cleaned_html: str, use_cache: bool = True) -> Generator[int, None, tuple[Optional[dict], Optional[str]]]:
+        """
+        Streaming variant of analyze_url_with_html.
+        Yields the number of response characters received so far; returns (selectors_dict, error_message)
+        Selectors are only cached once the caller confirms they extract products (confirm_selectors);
+        use_cache=False always asks the model, e.g. when regenerating selectors that stopped working.
+        """
+        self._pending_selectors = None
+        try:
+            # Selectors only need the page structure, so the model gets a skeleton instead of the full markup
+            prompt = SELECTOR_GENERATION_PROMPT.format(url=url, html=self.fetcher.skeletonize_html(cleaned_html))
+            cache_key = llm_cache.make_key('selectors', model=self.model, prompt=prompt)
+            response_text = llm_cache.get(cache_key, ttl=SELECTOR_CACHE_TTL) if use_cache else None
+            from_cache = response_text is not None
+
+            if response_text is None:
+                chunks = []
+                received = 0
+                with self.client.messages.stream(
+                    model=self.model,
+                    max_tokens=2000,
+                    messages=[{
+                        'role': 'user',
+                        'content': prompt
+                    }],
+                    tools=[SELECTOR_TOOL],
+                    tool_choice={'type': 'tool', 'name': SELECTOR_TOOL['name']}
+                ) as stream:
+                    for event in stream:
+                        if event.type == 'input_json':
+                            received += len(event.partial_json)
+                        elif event.type == 'text':
+                            chunks.append(event.text)
+                            received += len(event.text)
+                        else:
+                            continue
+                        yield received
+                    response = stream.get_final_message()
+
+                self.tokens_used += response.usage.input_tokens + response.usage.output_tokens
+
+                # The tool input is already parsed; a plain text answer goes through the JSON-from-prose parser
+                tool_input = _tool_input(response, SELECTOR_TOOL['name'])
+                if tool_input is not None:
+                    response_text = orjson.dumps(tool_input).decode()
+                else:
+                    response_text = ''.join(chunks).strip()
 
             # Try to extract JSON from response
             selectors = self._parse_json_response(response_text)
 
             if selectors:
+                self._pending_selectors = (cache_key, response_text, from_cache)
                 return selectors, None
 
             # Fallback
@@ -186,50 +423,65 @@ class ScraperService:
             logger.exception("Error analyzing HTML")
             return None, f"Error analyzing page: {str(e)}"
 
+    def confirm_selectors(self):
+        """Cache the last generated selectors now that they have extracted products from the page"""
+        if self._pending_selectors:
+            cache_key, response_text, from_cache = self._pending_selectors
+            if not from_cache:
+                llm_cache.set(cache_key, response_text)
+            self._pending_selectors = None
+
+    def reject_selectors(self):
+        """The last generated selectors extracted nothing: make sure they aren't served from the cache again"""
+        if self._pending_selectors:
+            cache_key, _, from_cache = self._pending_selectors
+            if from_cache:
+                llm_cache.delete(cache_key)
+            self._pending_selectors = None
+
     def _parse_json_response(self, text: str) -> Optional[dict]:
         """Parse JSON from LLM response, handling various formats"""
         # Try direct parse
         try:
-            return json.loads(text)
-        except json.JSONDecodeError:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
             pass
 
         # Try to find JSON in markdown code block
-        json_match = re.search(r'```(?:json)?\s*(\{[\s\S]*?\})\s*```', text)
+        json_match = _JSON_BLOCK_OBJ_RE.search(text)
         if json_match:
             try:
-                return json.loads(json_match.group(1))
-            except json.JSONDecodeError:
+                return orjson.loads(json_match.group(1))
+            except orjson.JSONDecodeError:
                 pass
 
         # Try to find raw JSON object
-        json_match = re.search(r'\{[\s\S]*\}', text)
-        if json_match:
-            try:
-                return json.loads(json_match.group(0))
-            except json.JSONDecodeError:
-                pass
-
-        return None
+        return _find_json(text, '{')
 
     def _extract_with_selectors(self, html: str, selectors: dict, base_url: str) -> list[dict]:
         """Extract products using CSS selectors"""
-        soup = BeautifulSoup(html, 'lxml')
+        if not html or not html.strip():
+            return []
+        return self._extract_from_tree(parse_html(html), selectors, base_url)
+
+    def _extract_from_tree(self, root, selectors: dict, base_url: str) -> list[dict]:
+        """Extract products using CSS selectors from an already parsed page"""
         products = []
 
         container_selector = selectors.get('product_container')
         if not container_selector:
             return []
 
-        containers = soup.select(container_selector)
+        # Limit to 50 products; the cap is applied inside the XPath so surplus matches never become Python objects
+        containers = _select_all(container_selector, root, 50)
 
-        for container in containers[:50]:  # Limit to 50 products
+        for container in containers:
             try:
                 product = self._extract_product_from_container(container, selectors, base_url)
                 if product and product.get('name'):
                     products.append(product)
             except Exception as e:
-                logger.debug(f"Error extracting from container: {e}")
+                logger.debug("Error extracting from container: %s", e)
                 continue
 
         return products
@@ -241,29 +493,29 @@ class ScraperService:
         # Extract name
         name_selector = selectors.get('name')
         if name_selector:
-            name_el = container.select_one(name_selector)
-            if name_el:
-                product['name'] = name_el.get_text(strip=True)
+            name_el = _select_one(name_selector, container)
+            if name_el is not None:
+                product['name'] = _get_text(name_el, strip=True)
 
         # Extract price
         price_selector = selectors.get('price')
         if price_selector:
-            price_el = container.select_one(price_selector)
-            if price_el:
-                product['price'] = self._parse_price(price_el.get_text())
+            price_el = _select_one(price_selector, container)
+            if price_el is not None:
+                product['price'] = self._parse_price(_get_text(price_el))
 
         # Extract original price
         original_price_selector = selectors.get('original_price')
         if original_price_selector:
-            orig_price_el = container.select_one(original_price_selector)
-            if orig_price_el:
-                product['original_price'] = self._parse_price(orig_price_el.get_text())
+            orig_price_el = _select_one(original_price_selector, container)
+            if orig_price_el is not None:
+                product['original_price'] = self._parse_price(_get_text(orig_price_el))
 
         # Extract image
         image_selector = selectors.get('image')
         if image_selector:
-            img_el = container.select_one(image_selector)
-            if img_el:
+            img_el = _select_one(image_selector, container)
+            if img_el is not None:
                 img_url = img_el.get('src') or img_el.get('data-src') or img_el.get('data-lazy-src')
                 if img_url:
                     product['image_url'] = self.fetcher.normalize_url(img_url, base_url)
@@ -271,8 +523,8 @@ class ScraperService:
         # Extract link
         link_selector = selectors.get('link')
         if link_selector:
-            link_el = container.select_one(link_selector)
-            if link_el:
+            link_el = _select_one(link_selector, container)
+            if link_el is not None:
                 href = link_el.get('href')
                 if href:
                     product['product_url'] = self.fetcher.normalize_url(href, base_url)
@@ -280,9 +532,9 @@ class ScraperService:
         # Extract description
         desc_selector = selectors.get('description')
         if desc_selector:
-            desc_el = container.select_one(desc_selector)
-            if desc_el:
-                product['description'] = desc_el.get_text(strip=True)[:500]
+            desc_el = _select_one(desc_selector, container)
+            if desc_el is not None:
+                product['description'] = _get_text(desc_el, strip=True)[:500]
 
         return product if product.get('name') else None
 
@@ -290,33 +542,7 @@ class ScraperService:
         """Parse price from text, handling various formats"""
         if not text:
             return None
-
-        # Remove currency symbols and whitespace
-        cleaned = re.sub(r'[^\d.,]', '', text)
-
-        # Handle different decimal formats
-        if ',' in cleaned and '.' in cleaned:
-            # Determine which is decimal separator
-            if cleaned.rfind(',') > cleaned.rfind('.'):
-                # European format: 1.234,56
-                cleaned = cleaned.replace('.', '').replace(',', '.')
-            else:
-                # US format: 1,234.56
-                cleaned = cleaned.replace(',', '')
-        elif ',' in cleaned:
-            # Could be decimal or thousands separator
-            parts = cleaned.split(',')
-            if len(parts) == 2 and len(parts[1]) == 2:
-                # Likely decimal: 12,99
-                cleaned = cleaned.replace(',', '.')
-            else:
-                # Likely thousands: 1,234
-                cleaned = cleaned.replace(',', '')
-
-        try:
-            return Decimal(cleaned)
-        except (InvalidOperation, ValueError):
-            return None
+        return _parse_price_text(text)
 
     def _generate_selectors_from_direct_extraction(self, html: str, url: str) -> tuple[Optional[dict], Optional[str]]:
         """Generate pseudo-selectors based on direct LLM extraction"""
@@ -334,132 +560,208 @@ class ScraperService:
         Returns (products_list, error_message, selectors_regenerated)
         """
         selectors_regenerated = False
+        self.regenerated_selectors = None
 
         # Fetch HTML if not provided
         if not html:
             requires_js = selectors.get('requires_javascript', False)
-            print(f"[SCRAPER] Fetching HTML (JS required: {requires_js})...")
+            logger.info("[SCRAPER] Fetching HTML (JS required: %s)...", requires_js)
             html, error = self.fetcher.fetch(url, require_javascript=requires_js)
             if error:
-                print(f"[SCRAPER] Fetch failed: {error}")
+                logger.info("[SCRAPER] Fetch failed: %s", error)
                 return [], error, False
-            print(f"[SCRAPER] Fetched {len(html):,} bytes")
+            logger.info("[SCRAPER] Fetched %d bytes", len(html))
 
         # Check if we need LLM extraction
         if selectors.get('use_llm_extraction'):
-            print("[SCRAPER] Using LLM extraction mode...")
+            logger.info("[SCRAPER] Using LLM extraction mode...")
             products, error = self._extract_with_llm(html, url)
             return products, error, False
 
-        # Try selector-based extraction
-        print("[SCRAPER] Trying selector-based extraction...")
-        products = self._extract_with_selectors(html, selectors, url)
+        # Try selector-based extraction (the page is parsed once and reused if selectors are regenerated)
+        logger.info("[SCRAPER] Trying selector-based extraction...")
+        root = parse_html(html)
+        products = self._extract_from_tree(root, selectors, url)
 
         # If no products found, regenerate selectors
         if not products:
-            print("[SCRAPER] No products found, regenerating selectors...")
-            logger.info(f"No products found with selectors for {url}, regenerating...")
-            new_selectors, error = self.analyze_url(url)
+            logger.info("[SCRAPER] No products found with selectors for %s, regenerating...", url)
+            # Analyze the page we already have rather than fetching it again
+            cleaned_html = self.fetcher.clean_html_for_llm(html)
+            # The stored selectors just failed on this page and a cached answer may well be the same ones,
+            # so the model is asked again
+            new_selectors, error = self.analyze_url_with_html(url, cleaned_html, use_cache=False)
             if error:
                 return [], error, False
 
             if new_selectors and not new_selectors.get('use_llm_extraction'):
-                products = self._extract_with_selectors(html, new_selectors, url)
-                selectors_regenerated = True
+                products = self._extract_from_tree(root, new_selectors, url)
+                if products:
+                    self.confirm_selectors()
+                    new_selectors['_sample_count'] = len(products)
+                    self.regenerated_selectors = new_selectors
+                    selectors_regenerated = True
+                else:
+                    self.reject_selectors()
 
             # Still no products? Try direct LLM extraction
             if not products:
-                print("[SCRAPER] Falling back to direct LLM extraction...")
-                products, error = self._extract_with_llm(html, url)
+                logger.info("[SCRAPER] Falling back to direct LLM extraction...")
+                products, error = self._extract_with_llm(html, url, cleaned_html=cleaned_html)
                 return products, error, selectors_regenerated
 
-        print(f"[SCRAPER] Extracted {len(products)} products")
+        logger.info("[SCRAPER] Extracted %d products", len(products))
         return products, None, selectors_regenerated
 
-    def _extract_with_llm(self, html: str, url: str) -> tuple[list[dict], Optional[str]]:
+    def _extract_with_llm(self, html: str, url: str, cleaned_html: str = None) -> tuple[list[dict], Optional[str]]:
         """Extract products directly using LLM (fallback method)"""
-        cleaned_html = self.fetcher.clean_html_for_llm(html, max_length=40000)
+        products = []
+        stream = self._extract_with_llm_stream(html, url, cleaned_html=cleaned_html)
+        while True:
+            try:
+                products.append(next(stream))
+            except StopIteration as stop:
+                error = stop.value
+                break
+        if error:
+            return [], error
+        return products, None
+
+    def _extract_with_llm_stream(self, html: str, url: str, cleaned_html: str = None) -> Generator[dict, None, Optional[str]]:
+        """
+        Streaming variant of _extract_with_llm.
+        Yields each product as soon as its JSON object is complete in the response; returns error_message
+        """
+        # HTML already cleaned for selector generation is reused when it fits the extraction budget;
+        # otherwise the raw page is cleaned again to the smaller budget (sampling beats blind truncation)
+        if cleaned_html is None or len(cleaned_html) > DIRECT_EXTRACTION_MAX_HTML:
+            cleaned_html = self.fetcher.clean_html_for_llm(html, max_length=DIRECT_EXTRACTION_MAX_HTML)
 
         try:
-            response = self.client.messages.create(
+            prompt = DIRECT_EXTRACTION_PROMPT.format(url=url, html=cleaned_html)
+            cache_key = llm_cache.make_key('extraction', model=self.model, prompt=prompt)
+            cached = llm_cache.get(cache_key, ttl=EXTRACTION_CACHE_TTL)
+            if cached is not None:
+                for product in self._parse_products_json(cached):
+                    yield self._normalize_llm_product(product, url)
+                return None
+
+            chunks = []
+            array = _StreamedJsonArray()
+            yielded = 0
+            with self.client.messages.stream(
                 model=self.model,
                 max_tokens=4000,
                 messages=[{
                     'role': 'user',
-                    'content': DIRECT_EXTRACTION_PROMPT.format(url=url, html=cleaned_html)
-                }]
-            )
+                    'content': prompt
+                }],
+                tools=[PRODUCTS_TOOL],
+                tool_choice={'type': 'tool', 'name': PRODUCTS_TOOL['name']}
+            ) as stream:
+                for event in stream:
+                    # The tool input streams as raw JSON ({"products": [...]}), the same text a plain answer would be
+                    if event.type == 'input_json':
+                        delta = event.partial_json
+                    elif event.type == 'text':
+                        delta = event.text
+                        chunks.append(delta)
+                    else:
+                        continue
+                    for product in array.feed(delta):
+                        yielded += 1
+                        yield self._normalize_llm_product(product, url)
+                response = stream.get_final_message()
 
             self.tokens_used += response.usage.input_tokens + response.usage.output_tokens
 
-            response_text = response.content[0].text.strip()
+            tool_input = _tool_input(response, PRODUCTS_TOOL['name'])
+            if tool_input is not None:
+                products = tool_input.get('products') or []
+                response_text = orjson.dumps(products).decode()
+            else:
+                products = None
+                response_text = ''.join(chunks).strip()
 
-            # Parse products JSON
-            products = self._parse_products_json(response_text)
+            # The response didn't stream as a clean array (or broke off mid-way);
+            # use the full answer and emit whatever wasn't yielded yet
+            if not array.done:
+                if products is None:
+                    products = self._parse_products_json(response_text)
+                for product in products[yielded:]:
+                    yield self._normalize_llm_product(product, url)
+                yielded = max(yielded, len(products))
 
-            # Normalize URLs
-            for product in products:
-                if product.get('image_url'):
-                    product['image_url'] = self.fetcher.normalize_url(product['image_url'], url)
-                if product.get('product_url'):
-                    product['product_url'] = self.fetcher.normalize_url(product['product_url'], url)
-                # Convert price to Decimal
-                if product.get('price'):
-                    product['price'] = Decimal(str(product['price']))
-                if product.get('original_price'):
-                    product['original_price'] = Decimal(str(product['original_price']))
+            if yielded:
+                llm_cache.set(cache_key, response_text)
 
-            return products, None
+            return None
 
         except Exception as e:
             logger.exception("Error in LLM extraction")
-            return [], f"LLM extraction error: {str(e)}"
+            return f"LLM extraction error: {str(e)}"
+
+    def _normalize_llm_product(self, product: dict, url: str) -> dict:
+        """Resolve URLs and convert prices of a product returned by the LLM"""
+        if product.get('image_url'):
+            product['image_url'] = self.fetcher.normalize_url(product['image_url'], url)
+        if product.get('product_url'):
+            product['product_url'] = self.fetcher.normalize_url(product['product_url'], url)
+        # Convert price to Decimal
+        if product.get('price'):
+            product['price'] = Decimal(str(product['price']))
+        if product.get('original_price'):
+            product['original_price'] = Decimal(str(product['original_price']))
+        return product
 
     def _parse_products_json(self, text: str) -> list[dict]:
-        """Parse products JSON array from LLM response"""
+        """Parse products JSON (a return_products tool input or a bare array) from LLM response"""
         # Try direct parse
         try:
-            result = json.loads(text)
+            result = orjson.loads(text)
+            if isinstance(result, dict):
+                return result.get('products') or []
             if isinstance(result, list):
                 return result
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             pass
 
         # Try to find JSON array in markdown code block
-        json_match = re.search(r'```(?:json)?\s*(\[[\s\S]*?\])\s*```', text)
+        json_match = _JSON_BLOCK_ARR_RE.search(text)
         if json_match:
             try:
-                return json.loads(json_match.group(1))
-            except json.JSONDecodeError:
+                return orjson.loads(json_match.group(1))
+            except orjson.JSONDecodeError:
                 pass
 
         # Try to find raw JSON array
-        json_match = re.search(r'\[[\s\S]*\]', text)
-        if json_match:
-            try:
-                return json.loads(json_match.group(0))
-            except json.JSONDecodeError:
-                pass
-
-        return []
+        return _find_json(text, '[', accept=lambda items: all(isinstance(item, dict) for item in items)) or []
 
     def preview_extraction(self, url: str) -> tuple[Optional[dict], list[dict], Optional[str]]:
         """
         Preview what would be extracted from a URL.
         Returns (selectors, sample_products, error_message)
         """
-        # Analyze the URL to get selectors
-        selectors, error = self.analyze_url(url)
+        # Fetch once; the same page is analyzed and extracted
+        html, error = self.fetcher.fetch(url)
+        if error:
+            return None, [], error
+
+        # Analyze the page to get selectors
+        cleaned_html = self.fetcher.clean_html_for_llm(html)
+        selectors, error = self.analyze_url(url, html=html, cleaned_html=cleaned_html)
         if error:
             return None, [], error
 
-        # Fetch and extract
-        html, fetch_error = self.fetcher.fetch(url, selectors.get('requires_javascript', False))
-        if fetch_error:
-            return selectors, [], fetch_error
+        # Only refetch when the products need a browser to render
+        if selectors.get('requires_javascript'):
+            html, fetch_error = self.fetcher.fetch(url, True)
+            if fetch_error:
+                return selectors, [], fetch_error
+            cleaned_html = None
 
         if selectors.get('use_llm_extraction'):
-            products, extract_error = self._extract_with_llm(html, url)
+            products, extract_error = self._extract_with_llm(html, url, cleaned_html=cleaned_html)
         else:
             products = self._extract_with_selectors(html, selectors, url)
             extract_error = None
@@ -4,32 +4,123 @@ Database initialization script
 Creates tables and adds default admin user (admin/admin)
 """
 
+import hashlib
+import sys
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.schema import CreateIndex, CreateTable
+
 from app import create_app, db
-from app.models import User
+from app.models import User, UserSettings, mask_api_key
+
+# Idempotent upgrades for databases created before a column/index was added.
+# db.create_all() only creates missing tables, not missing columns.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE user_settings ADD COLUMN IF NOT EXISTS masked_api_key VARCHAR(255)",
+    "CREATE INDEX IF NOT EXISTS ix_products_source_first_seen ON products (source_id, first_seen_at DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_products_source_last_updated ON products (source_id, last_updated_at DESC)",
+    "CREATE INDEX IF NOT EXISTS ix_products_source_price ON products (source_id, current_price)",
+    "CREATE INDEX IF NOT EXISTS ix_products_favorite ON products (source_id) WHERE is_favorite",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS is_price_drop BOOLEAN GENERATED ALWAYS AS "
+    "(original_price IS NOT NULL AND current_price < original_price) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_products_price_drop ON products (source_id, last_updated_at DESC) "
+    "WHERE is_price_drop",
+    "CREATE INDEX IF NOT EXISTS ix_sync_logs_source_started ON sync_logs (source_id, started_at DESC)",
+    "ALTER TABLE sources ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT now()",
+    # Older databases may hold duplicate (source_id, product_url) rows; skip the constraint rather than fail
+    "DO $$ BEGIN "
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_product_source_url ON products (source_id, product_url); "
+    "EXCEPTION WHEN unique_violation THEN "
+    "RAISE NOTICE 'Duplicate products per source URL, uq_product_source_url not created'; "
+    "END $$",
+    "CREATE INDEX IF NOT EXISTS ix_products_source_available ON products (source_id, is_available)",
+]
+
+def schema_version() -> str:
+    """Fingerprint of the declared tables and upgrades; changes whenever either does"""
+    dialect = postgresql.dialect()
+    ddl = []
+    for table in db.metadata.sorted_tables:
+        ddl.append(str(CreateTable(table).compile(dialect=dialect)))
+        ddl.extend(str(CreateIndex(index).compile(dialect=dialect))
+                   for index in sorted(table.indexes, key=lambda index: index.name))
+    return hashlib.sha256('\n'.join(ddl + SCHEMA_UPGRADES).encode()).hexdigest()[:16]
+
 
-def init_database():
+def stored_schema_version():
+    """Schema version recorded by the last complete run, or None"""
+    if db.session.execute(text("SELECT to_regclass('schema_meta')")).scalar() is None:
+        return None
+    return db.session.execute(text("SELECT value FROM schema_meta WHERE key = 'version'")).scalar()
+
+
+def init_database(force: bool = False):
     """Initialize database with tables and default user"""
     app = create_app()
 
     with app.app_context():
+        # A completed run for the same schema already created everything below
+        version = schema_version()
+        if not force and stored_schema_version() == version:
+            print(f"✓ Database schema is up to date (version {version}), nothing to do")
+            print("  Run with --force to re-apply tables, upgrades and the admin user check")
+            return
+
+        # Everything below runs in one transaction on one connection (PostgreSQL DDL is transactional):
+        # a failed step leaves no half-initialized schema and no version is recorded
+        connection = db.session.connection()
+
         print("Creating database tables...")
-        db.create_all()
+        # Required by the trigram index on products.name
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        db.metadata.create_all(bind=connection)
         print("✓ Tables created successfully")
 
-        # Check if admin user already exists
-        admin = User.query.filter_by(username='admin').first()
-        if admin:
-            print("⚠ Admin user already exists, skipping creation")
-        else:
-            # Create admin user
+        for statement in SCHEMA_UPGRADES:
+            connection.execute(text(statement))
+
+        # Keys saved before masked_api_key existed
+        for settings in UserSettings.query.filter(
+            UserSettings.encrypted_api_key.isnot(None),
+            UserSettings.masked_api_key.is_(None)
+        ):
+            settings.masked_api_key = mask_api_key(settings.get_api_key())
+        db.session.flush()
+        print("✓ Schema upgrades applied")
+
+        # Create the admin user unless it already exists. The lookup comes first so the (deliberately
+        # slow) Argon2 hash only runs when a row will actually be inserted; ON CONFLICT covers a
+        # concurrent init creating it in between
+        created = None
+        if db.session.execute(db.select(User.id).filter_by(username='admin')).scalar() is None:
             admin = User(username='admin')
             admin.set_password('admin')
-            db.session.add(admin)
-            db.session.commit()
+            created = db.session.execute(
+                pg_insert(User)
+                .values(username=admin.username, password_hash=admin.password_hash)
+                .on_conflict_do_nothing(index_elements=['username'])
+                .returning(User.id)
+            ).scalar()
+
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_meta (key VARCHAR(64) PRIMARY KEY, value TEXT NOT NULL)"
+        ))
+        connection.execute(text(
+            "INSERT INTO schema_meta (key, value) VALUES ('version', :version) "
+            "ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value"
+        ), {'version': version})
+        db.session.commit()
+
+        if created:
             print("✓ Admin user created (username: admin, password: admin)")
+        else:
+            print("⚠ Admin user already exists, skipping creation")
 
         print("\n✓ Database initialization complete!")
         print("You can now run the application with: python app.py")
 
 if __name__ == '__main__':
-    init_database()
+    init_database(force='--force' in sys.argv[1:])
@@ -0,0 +1,29 @@
+from app.services.scraper_service import ScraperService
+
+PAGE = """
+<div class="grid">
+  <div class="product"><h3 class="title">Desk lamp</h3><span class="price">€ 24,99</span></div>
+  <div class="product"><h3 class="title">Floor lamp</h3><span class="price">€ 89,00</span></div>
+</div>
+"""
+
+
+def make_scraper():
+    return ScraperService(api_key='test-key')
+
+
+def test_unsupported_container_selector_matches_nothing():
+    """cssselect can't translate *:first-of-type; it must read as "no products", not raise"""
+    products = make_scraper()._extract_with_selectors(
+        PAGE, {'product_container': '*:first-of-type', 'name': '.title'}, 'https://shop.test/'
+    )
+    assert products == []
+
+
+def test_unsupported_field_selector_skips_only_that_field():
+    products = make_scraper()._extract_with_selectors(
+        PAGE, {'product_container': 'div.product', 'name': '.title', 'price': '*:first-of-type'},
+        'https://shop.test/'
+    )
+    assert [product['name'] for product in products] == ['Desk lamp', 'Floor lamp']
+    assert all('price' not in product for product in products)
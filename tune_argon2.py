@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Argon2 tuning script
+Finds the largest memory_cost whose verify time stays under a target on this host
+"""
+
+import argparse
+import time
+
+from argon2 import PasswordHasher
+
+
+def measure(time_cost, memory_cost, parallelism, rounds):
+    """Return the average verify time in milliseconds"""
+    ph = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    password_hash = ph.hash('tune-argon2-password')
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        ph.verify(password_hash, 'tune-argon2-password')
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+def tune(target_ms, time_cost, parallelism, rounds):
+    """Binary search memory_cost (KiB) for the target verify time"""
+    low, high = 8 * 1024, 1024 * 1024  # 8 MiB .. 1 GiB
+    best = None
+
+    while low <= high:
+        memory_cost = (low + high) // 2
+        elapsed = measure(time_cost, memory_cost, parallelism, rounds)
+        print(f"  memory_cost={memory_cost:>8} KiB  verify={elapsed:7.1f} ms")
+
+        if elapsed <= target_ms:
+            best = (memory_cost, elapsed)
+            low = memory_cost + 1024
+        else:
+            high = memory_cost - 1024
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--target-ms', type=float, default=250, help='Target verify time per login')
+    parser.add_argument('--time-cost', type=int, default=3)
+    parser.add_argument('--parallelism', type=int, default=1)
+    parser.add_argument('--rounds', type=int, default=3, help='Verifies averaged per measurement')
+    args = parser.parse_args()
+
+    print(f"Tuning Argon2 for a {args.target_ms:.0f} ms verify (time_cost={args.time_cost}, "
+          f"parallelism={args.parallelism})...")
+    best = tune(args.target_ms, args.time_cost, args.parallelism, args.rounds)
+
+    if not best:
+        print("⚠ Even the minimum memory_cost exceeds the target, lower --time-cost")
+        return
+
+    memory_cost, elapsed = best
+    print(f"\n✓ Recommended parameters ({elapsed:.1f} ms per verify):")
+    print(f"    time_cost={args.time_cost}")
+    print(f"    memory_cost={memory_cost}")
+    print(f"    parallelism={args.parallelism}")
+
+
+if __name__ == '__main__':
+    main()